@@ -0,0 +1,126 @@
+"""Generate quizzes for many topics from the command line, without Streamlit.
+
+Usage:
+    python batch_quiz.py topics.txt --output quizzes.jsonl --num-questions 10 --concurrency 4 --rate-limit 20
+
+Topics are read one per line (blank lines and lines starting with '#' are ignored). Each finished topic is
+appended to the output JSONL file as soon as it completes; re-running the same command resumes from that
+file and only processes topics that have no successful result yet.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from quiz import retrieve_mcqs
+
+
+class RateLimiter:
+    """Spaces out calls so that at most per_minute start in any minute."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute and per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+
+def read_topics(path):
+    with open(path, encoding="utf-8") as f:
+        topics = [line.strip() for line in f]
+    # Keep the first occurrence of each topic, in file order
+    return list(dict.fromkeys(t for t in topics if t and not t.startswith('#')))
+
+
+def completed_topics(output_path):
+    """Topics that already have a successful result in the output file (the checkpoint)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partially written last line; that topic is simply redone
+                continue
+            if record.get("questions") and not record.get("error"):
+                done.add(record["topic"])
+    return done
+
+
+def ends_mid_line(path):
+    """Whether the file's last line was cut off before its newline, e.g. by a crash mid-write."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def generate_topic(topic, num_questions, limiter):
+    limiter.wait()
+    start = time.perf_counter()
+    try:
+        questions = retrieve_mcqs(topic, num_questions)
+        error = None if questions else "no questions generated"
+    except Exception as e:
+        questions, error = [], str(e)
+    return {
+        "topic": topic,
+        "num_questions": num_questions,
+        "questions": questions,
+        "error": error,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate quizzes for a list of topics.")
+    parser.add_argument("topics_file", help="Text file with one topic per line")
+    parser.add_argument("--output", default="quizzes.jsonl", help="JSONL file results are appended to; also the resume checkpoint")
+    parser.add_argument("--num-questions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4, help="Topics generated in parallel")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Maximum topics started per minute (0 = unlimited)")
+    args = parser.parse_args(argv)
+
+    topics = read_topics(args.topics_file)
+    done = completed_topics(args.output)
+    pending = [t for t in topics if t not in done]
+    print(f"{len(topics)} topics, {len(topics) - len(pending)} already done, {len(pending)} to generate")
+
+    limiter = RateLimiter(args.rate_limit)
+    failures = 0
+    partial_line = ends_mid_line(args.output)
+    with open(args.output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        if partial_line:
+            # Otherwise the first new record would be glued onto the cut-off line and lost with it
+            out.write("\n")
+        futures = [executor.submit(generate_topic, topic, args.num_questions, limiter) for topic in pending]
+        for finished, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            # Write and flush each result immediately so a crash loses at most the in-flight topics
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            if record["error"]:
+                failures += 1
+            status = f"failed: {record['error']}" if record["error"] else f"{len(record['questions'])} questions"
+            print(f"[{finished}/{len(pending)}] {record['topic']}: {status} ({record['seconds']}s)")
+
+    print(f"Done: {len(pending) - failures} succeeded, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,142 @@
+"""End-to-end benchmark of uploads, question generation and quiz retrieval against local mock servers.
+
+Usage:
+    python benchmarks/e2e_benchmark.py --iterations 30 --concurrency 4 --completion-latency 0.5 --error-rate 0.02
+
+Every scenario runs offline against benchmarks/mock_servers.py and reports p50/p95 latency, throughput,
+failures and memory (peak traced Python allocations plus process max RSS). Caches are disabled by default so
+each operation does real work; pass --with-cache to measure warm-cache behaviour instead.
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_servers import CANNED_PASSAGES, MockConfig, MockServer  # noqa: E402
+
+
+class NamedBytesIO(io.BytesIO):
+    """In-memory stand-in for Streamlit's UploadedFile."""
+
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_scenario(name, operation, iterations, concurrency, trace_memory):
+    """Runs operation(i) iterations times on a thread pool and summarises latency, throughput and memory."""
+    if trace_memory:
+        tracemalloc.start()
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            ok = operation(i)
+        except Exception as e:
+            print(f"{name} iteration {i} failed: {e}", file=sys.stderr)
+            ok = False
+        return time.perf_counter() - start, bool(ok)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, range(iterations)))
+    wall = time.perf_counter() - start
+
+    peak_traced = None
+    if trace_memory:
+        peak_traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    latencies = [seconds for seconds, _ in outcomes]
+    return {
+        "scenario": name,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "failures": sum(1 for _, ok in outcomes if not ok),
+        "p50": statistics.median(latencies),
+        "p95": percentile(latencies, 0.95),
+        "max": max(latencies),
+        "throughput_per_s": iterations / wall if wall else float("inf"),
+        "peak_traced_mb": peak_traced / 1e6 if peak_traced is not None else None,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--num-questions", type=int, default=10)
+    parser.add_argument("--upload-mb", type=float, default=5.0, help="Size of each synthetic uploaded file")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock Vectara latency in seconds")
+    parser.add_argument("--completion-latency", type=float, default=0.5, help="Mock OpenAI latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock calls failing with 429/503")
+    parser.add_argument("--scenarios", default="upload,generate,retrieve", help="Comma-separated subset to run")
+    parser.add_argument("--with-cache", action="store_true", help="Keep retrieval/generation caches enabled")
+    parser.add_argument("--no-trace-memory", action="store_true", help="Skip tracemalloc (it slows Python code down)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON only")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, completion_latency=args.completion_latency, error_rate=args.error_rate)
+    with MockServer(config) as server:
+        os.environ.update(server.environment())
+        os.environ.setdefault("OPENAI_RPM", "0")
+        os.environ.setdefault("OPENAI_TPM", "0")
+        if not args.with_cache:
+            os.environ["GENERATION_CACHE_PATH"] = ""
+            os.environ["RETRIEVAL_CACHE_SIZE"] = "0"
+            os.environ.pop("QUESTION_BANK_PATH", None)
+
+        # Imported only now: these modules read their configuration from the environment at import time
+        import quiz
+        from vectara import Indexing
+
+        indexer = Indexing()
+        upload_bytes = b"%PDF-1.4\n" + os.urandom(int(args.upload_mb * 1e6))
+        context = "\n\n".join(CANNED_PASSAGES)
+
+        scenarios = {
+            "upload": lambda i: indexer.upload_file(
+                1, 1, os.environ["IDX_ADDRESS"], NamedBytesIO(upload_bytes, f"doc-{i}.pdf"), f"doc-{i}.pdf")[1],
+            # Vary the inputs so single-flight and caches do not collapse iterations into one call
+            "generate": lambda i: quiz.generate_questions_data(f"{context}\n\nVariant {i}", args.num_questions),
+            "retrieve": lambda i: quiz.retrieve_mcqs(f"photosynthesis topic {i}", args.num_questions),
+        }
+
+        results = []
+        for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+            results.append(run_scenario(name, scenarios[name], args.iterations, args.concurrency,
+                                        trace_memory=not args.no_trace_memory))
+        results.append({"scenario": "mock_server_calls", **config.counts})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    for result in results:
+        if result["scenario"] == "mock_server_calls":
+            print("mock server calls: " + ", ".join(f"{k}={v}" for k, v in result.items() if k != "scenario"))
+            continue
+        traced = f"{result['peak_traced_mb']:.1f}MB" if result["peak_traced_mb"] is not None else "n/a"
+        print(f"{result['scenario']:>9}: p50 {result['p50'] * 1000:7.1f}ms  p95 {result['p95'] * 1000:7.1f}ms  "
+              f"{result['throughput_per_s']:6.2f}/s  failures {result['failures']}  "
+              f"peak traced {traced}  max RSS {result['max_rss_mb']:.0f}MB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
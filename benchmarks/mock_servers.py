@@ -0,0 +1,267 @@
+"""Local stand-ins for the Vectara and OpenAI endpoints the app uses, for offline benchmarking.
+
+Run standalone to point a manual session at them:
+    python benchmarks/mock_servers.py --latency 0.2 --error-rate 0.05
+
+Endpoints served (all on one port):
+    POST /oauth2/token          client-credentials token (AUTH_URL)
+    POST /v1/upload             Vectara file upload (IDX_ADDRESS); the body is consumed and discarded
+    POST /v1/index              Vectara document indexing (VECTARA_API_URL)
+    POST /v1/delete-doc         Vectara document deletion (VECTARA_API_URL)
+    POST /v1/query              Vectara query with canned, scored passages (VECTARA_API_URL)
+    POST /v1/chat/completions   OpenAI chat completions, streaming or not (OPENAI_BASE_URL=<url>/v1)
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_PASSAGES = [
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "Chlorophyll in the chloroplasts absorbs mostly blue and red light.",
+    "The light-dependent reactions take place in the thylakoid membranes.",
+    "The Calvin cycle fixes carbon dioxide into three-carbon sugars in the stroma.",
+    "Oxygen released during photosynthesis comes from splitting water molecules.",
+    "Stomata regulate gas exchange and water loss in leaves.",
+    "C4 plants concentrate carbon dioxide to reduce photorespiration.",
+    "ATP and NADPH produced by light reactions power the Calvin cycle.",
+    "Rubisco is the enzyme that catalyses carbon fixation.",
+    "Cellular respiration releases the energy stored by photosynthesis.",
+]
+
+_SUBJECTS = ["chlorophyll", "the Calvin cycle", "stomata", "rubisco", "thylakoids", "ATP synthase", "the stroma",
+             "photorespiration", "NADPH", "glucose", "water splitting", "C4 plants", "CAM plants", "light intensity"]
+_ASPECTS = ["primary role", "location in the cell", "main product", "limiting factor", "energy source",
+            "evolutionary advantage", "chemical input", "regulation"]
+
+
+class MockConfig:
+    """Latency and failure behaviour of the mock endpoints."""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0,
+                 completion_latency: float = 0.5, token_delay: float = 0.002, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.completion_latency = completion_latency
+        self.token_delay = token_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def delay(self, base: float):
+        with self.lock:
+            seconds = max(0.0, base + self.random.uniform(-self.jitter, self.jitter))
+        time.sleep(seconds)
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def count(self, path: str):
+        with self.lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+
+
+def canned_questions(count: int, salt: str = "") -> list:
+    """Distinct, schema-valid questions so deduplication does not discard them."""
+    rng = random.Random(f"{count}:{salt}")
+    pairs = [(s, a) for s in _SUBJECTS for a in _ASPECTS]
+    rng.shuffle(pairs)
+    return [
+        {
+            "question": f"What is the {aspect} of {subject}?",
+            "distractor1": f"{subject} distractor alpha {i}",
+            "distractor2": f"{subject} distractor beta {i}",
+            "distractor3": f"{subject} distractor gamma {i}",
+            "correct_answer": f"The {aspect} of {subject} (answer {i})",
+            "support": CANNED_PASSAGES[i % len(CANNED_PASSAGES)],
+        }
+        for i, (subject, aspect) in enumerate(pairs[:count])
+    ]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self, discard: bool = False) -> bytes:
+        """Reads the request body; with discard, only the first 4KB is kept so large uploads stay out of memory."""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip() or b"0", 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunk = self.rfile.read(size)
+                if not discard or sum(map(len, chunks)) < 4096:
+                    chunks.append(chunk)
+                self.rfile.readline()
+            return b"".join(chunks)[:4096] if discard else b"".join(chunks)
+        length = int(self.headers.get("Content-Length") or 0)
+        if not discard:
+            return self.rfile.read(length)
+        # Read in blocks so large uploads are not held in memory by the mock itself
+        remaining, head = length, b""
+        while remaining:
+            block = self.rfile.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            if len(head) < 4096:
+                head += block[:4096 - len(head)]
+            remaining -= len(block)
+        return head
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        body = self._read_body(discard=path.endswith("/v1/upload"))
+        self.config.count(path)
+
+        if path.endswith("/oauth2/token"):
+            return self._send_json(200, {"access_token": "mock-token", "token_type": "Bearer", "expires_in": 3600})
+
+        is_completion = path.endswith("/chat/completions")
+        self.config.delay(self.config.completion_latency if is_completion else self.config.latency)
+        if self.config.should_fail():
+            return self._send_json(self.config.random.choice([429, 503]), {"error": "injected failure"})
+
+        if path.endswith("/v1/upload"):
+            return self._send_json(200, {"response": {"status": {"code": "OK"}}})
+        if path.endswith("/v1/index"):
+            return self._send_json(200, {"status": {"code": "OK"}})
+        if path.endswith("/v1/delete-doc"):
+            return self._send_json(200, {})
+        if path.endswith("/v1/query"):
+            request = json.loads(body or b"{}")
+            num_results = request.get("query", [{}])[0].get("num_results", 10)
+            passages = [{"text": text, "score": round(1.0 - i * 0.05, 3)}
+                        for i, text in enumerate(CANNED_PASSAGES[:num_results])]
+            return self._send_json(200, {"responseSet": [{"response": passages}]})
+        if is_completion:
+            return self._chat_completion(json.loads(body or b"{}"))
+        self._send_json(404, {"error": f"unknown path {path}"})
+
+    def _chat_completion(self, request: dict):
+        prompt = "\n".join(m.get("content", "") for m in request.get("messages", []))
+        match = re.search(r"form (\d+) distinct", prompt)
+        variants = re.search(r"Write (\d+) different search queries.*Topic: (.*)", prompt, re.S)
+        count = int(match.group(1)) if match else 1
+        if match:
+            content = json.dumps({"questions-data": canned_questions(count, salt=prompt[-200:])})
+        elif variants:
+            topic = variants.group(2).strip()
+            content = json.dumps({"queries": [f"{topic} {aspect}" for aspect in _ASPECTS[:int(variants.group(1))]]})
+        else:
+            content = json.dumps(canned_questions(1, salt=prompt[-200:])[0])
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                 "total_tokens": (len(prompt) + len(content)) // 4}
+
+        if not request.get("stream"):
+            return self._send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(content), 16):
+            piece = content[start:start + 16]
+            event = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": request.get("model", "mock"),
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            time.sleep(self.config.token_delay)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockServer:
+    """Runs the mock endpoints on a background thread; use as a context manager."""
+
+    def __init__(self, config: MockConfig = None, host: str = "127.0.0.1", port: int = 0):
+        handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config or MockConfig()})
+        self.config = handler.config
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self) -> dict:
+        """Environment variables that point vectara.py and the OpenAI client at this server."""
+        return {
+            "AUTH_URL": self.url,
+            "APP_CLIENT_ID": "mock",
+            "APP_CLIENT_SECRET": "mock",
+            "CUSTOMER_ID": "1",
+            "CORPUS_ID": "1",
+            "API_KEY": "mock",
+            "IDX_ADDRESS": self.url,
+            "VECTARA_API_URL": self.url,
+            "OPENAI_API_KEY": "mock",
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+        }
+
+    def start(self) -> "MockServer":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve mock Vectara and OpenAI endpoints.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to Vectara calls")
+    parser.add_argument("--completion-latency", type=float, default=0.5, help="Seconds added to chat completions")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with 429/503")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(args.latency, args.jitter, args.error_rate, args.completion_latency)
+    server = MockServer(config, port=args.port)
+    for key, value in server.environment().items():
+        print(f"export {key}={value}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
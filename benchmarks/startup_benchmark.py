@@ -0,0 +1,94 @@
+"""Measures cold import time of the app modules and the per-rerun overhead of the Streamlit script.
+
+Usage:
+    python benchmarks/startup_benchmark.py --reruns 20 --max-import-seconds 1.5 --max-rerun-seconds 0.2
+
+Import times are measured in fresh interpreters so module caches do not hide regressions. Reruns are driven
+with Streamlit's AppTest harness using dummy secrets, so no network access is needed: nothing that talks to
+Vectara or OpenAI may run during a plain rerun. The script exits non-zero when a threshold is exceeded.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py is a Streamlit script, so its cost is measured through AppTest reruns instead of a bare import
+MODULES = ["vectara", "quiz"]
+DUMMY_SECRETS = {
+    "AUTH_URL": "https://auth.invalid",
+    "APP_CLIENT_ID": "benchmark",
+    "APP_CLIENT_SECRET": "benchmark",
+    "CUSTOMER_ID": "1",
+    "CORPUS_ID": "1",
+    "IDX_ADDRESS": "api.invalid",
+    "API_KEY": "benchmark",
+    "OPENAI_API_KEY": "benchmark",
+}
+
+
+def import_seconds(module: str, repeats: int) -> float:
+    """Median wall-clock time to import a module in a fresh interpreter."""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    samples = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True)
+        samples.append(float(output.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def rerun_seconds(reruns: int) -> dict:
+    """Times the first script run and subsequent reruns of app.py."""
+    from streamlit.testing.v1 import AppTest
+
+    app_test = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    for key, value in DUMMY_SECRETS.items():
+        app_test.secrets[key] = value
+
+    start = time.perf_counter()
+    app_test.run()
+    first_run = time.perf_counter() - start
+    if app_test.exception:
+        raise RuntimeError(f"app.py raised during the benchmark run: {app_test.exception}")
+
+    samples = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        app_test.run()
+        samples.append(time.perf_counter() - start)
+    return {
+        "first_run": first_run,
+        "rerun_median": statistics.median(samples),
+        "rerun_max": max(samples),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--import-repeats", type=int, default=3)
+    parser.add_argument("--reruns", type=int, default=20)
+    parser.add_argument("--max-import-seconds", type=float, default=None, help="Fail if any module import is slower")
+    parser.add_argument("--max-rerun-seconds", type=float, default=None, help="Fail if the median rerun is slower")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    results = {"imports": {m: import_seconds(m, args.import_repeats) for m in MODULES}}
+    results.update(rerun_seconds(args.reruns))
+    print(json.dumps(results, indent=2))
+
+    failures = []
+    if args.max_import_seconds is not None:
+        failures += [f"import {m}: {s:.3f}s" for m, s in results["imports"].items() if s > args.max_import_seconds]
+    if args.max_rerun_seconds is not None and results["rerun_median"] > args.max_rerun_seconds:
+        failures.append(f"median rerun: {results['rerun_median']:.3f}s")
+    if failures:
+        print("Regression thresholds exceeded: " + ", ".join(failures), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
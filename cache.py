@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class RetrievalCache:
+    """LRU cache with TTL for Vectara query results, optionally backed by a SQLite file."""
+
+    def __init__(self, max_size: int = 256, ttl: float = 3600.0, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS retrieval_cache "
+                "(key TEXT PRIMARY KEY, corpus_id TEXT, expires_at REAL, value TEXT)"
+            )
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> "RetrievalCache":
+        return cls(
+            max_size=int(os.getenv('RETRIEVAL_CACHE_SIZE', 256)),
+            ttl=float(os.getenv('RETRIEVAL_CACHE_TTL', 3600)),
+            path=os.getenv('RETRIEVAL_CACHE_PATH') or None,
+        )
+
+    @staticmethod
+    def make_key(corpus_id, query_text: str, num_results: int, summarizer_prompt_name: str, response_lang: str) -> str:
+        """Builds the cache key; query text is case- and whitespace-normalized."""
+        normalized_query = " ".join(str(query_text).lower().split())
+        return json.dumps([str(corpus_id), normalized_query, num_results, summarizer_prompt_name, response_lang])
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, _, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT corpus_id, expires_at, value FROM retrieval_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    corpus_id, expires_at, value = row
+                    if expires_at > now:
+                        value = json.loads(value)
+                        self._store_memory(key, corpus_id, expires_at, value)
+                        return value
+                    self._db.execute("DELETE FROM retrieval_cache WHERE key = ?", (key,))
+                    self._db.commit()
+        return None
+
+    def set(self, key: str, corpus_id, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store_memory(key, str(corpus_id), expires_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO retrieval_cache (key, corpus_id, expires_at, value) VALUES (?, ?, ?, ?)",
+                    (key, str(corpus_id), expires_at, json.dumps(value)),
+                )
+                self._db.commit()
+
+    def _store_memory(self, key, corpus_id, expires_at, value):
+        self._entries[key] = (expires_at, corpus_id, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate_corpus(self, corpus_id):
+        """Drops every cached result for a corpus, e.g. after new documents were indexed into it."""
+        corpus_id = str(corpus_id)
+        with self._lock:
+            for key in [k for k, (_, cid, _) in self._entries.items() if cid == corpus_id]:
+                del self._entries[key]
+            if self._db is not None:
+                self._db.execute("DELETE FROM retrieval_cache WHERE corpus_id = ?", (corpus_id,))
+                self._db.commit()
+
+    def record(self, hit: bool, seconds: float):
+        """Records the outcome and latency of a lookup for the stats report."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.hit_seconds += seconds
+            else:
+                self.misses += 1
+                self.miss_seconds += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "avg_hit_latency": self.hit_seconds / self.hits if self.hits else 0.0,
+                "avg_miss_latency": self.miss_seconds / self.misses if self.misses else 0.0,
+            }
+
+
+_retrieval_cache = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    """Returns the process-wide retrieval cache, configured from the environment."""
+    global _retrieval_cache
+    with _retrieval_cache_lock:
+        if _retrieval_cache is None:
+            _retrieval_cache = RetrievalCache.from_env()
+        return _retrieval_cache
+
+
+class GenerationCache:
+    """Persistent SQLite cache of parsed LLM question lists, addressed by a hash of everything that shaped them."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS generation_cache "
+            "(key TEXT PRIMARY KEY, created_at REAL, value TEXT)"
+        )
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, prompt_version: str, temperature: float, context: str, questions_no) -> str:
+        payload = json.dumps([model, prompt_version, temperature, context, questions_no], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM generation_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO generation_cache (key, created_at, value) VALUES (?, ?, ?)",
+                (key, time.time(), json.dumps(value, ensure_ascii=False)),
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+_generation_cache = None
+_generation_cache_lock = threading.Lock()
+
+
+def get_generation_cache() -> Optional[GenerationCache]:
+    """Returns the process-wide generation cache, or None when GENERATION_CACHE_PATH is set to an empty value."""
+    global _generation_cache
+    path = os.getenv('GENERATION_CACHE_PATH', os.path.join('.cache', 'generation_cache.sqlite'))
+    if not path:
+        return None
+    with _generation_cache_lock:
+        if _generation_cache is None:
+            _generation_cache = GenerationCache(path)
+        return _generation_cache
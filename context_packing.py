@@ -0,0 +1,84 @@
+import os
+from typing import List
+
+from dedup import NearDuplicateFilter
+from scheduler import estimate_tokens
+
+# Token budget for the generation context: a base amount plus a share per requested question
+CONTEXT_BASE_TOKENS = int(os.getenv('CONTEXT_BASE_TOKENS', 600))
+CONTEXT_TOKENS_PER_QUESTION = int(os.getenv('CONTEXT_TOKENS_PER_QUESTION', 250))
+CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', 6000))
+# Estimated Jaccard similarity above which two passages are treated as overlapping
+PASSAGE_OVERLAP_THRESHOLD = float(os.getenv('PASSAGE_OVERLAP_THRESHOLD', 0.6))
+# Rank damping constant for reciprocal-rank fusion; 60 is the value from the original RRF paper
+RRF_K = int(os.getenv('RRF_K', 60))
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    # Loading the BPE ranks is slow, so it happens on first use rather than at import time
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # tiktoken is optional; fall back to a character-based estimate
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Counts tokens locally with tiktoken when available, otherwise estimates them."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def context_budget(num_questions: int) -> int:
+    return min(CONTEXT_MAX_TOKENS, CONTEXT_BASE_TOKENS + CONTEXT_TOKENS_PER_QUESTION * num_questions)
+
+
+def reciprocal_rank_fusion(result_lists: List[List[dict]], k: int = RRF_K) -> List[dict]:
+    """Merges several ranked result lists into one, scoring each passage by the sum of 1 / (k + rank).
+
+    Passages with the same whitespace-normalised text are merged; the fused score replaces the
+    per-query retrieval scores, which are not comparable across queries.
+    """
+    fused = {}
+    for results in result_lists:
+        for rank, result in enumerate((r for r in results if r.get('text')), start=1):
+            key = " ".join(result['text'].split())
+            entry = fused.setdefault(key, {'text': result['text'], 'score': 0.0})
+            entry['score'] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda r: r['score'], reverse=True)
+
+
+def pack_context(results: List[dict], num_questions: int, budget: int = None) -> List[str]:
+    """Picks the best-ranked, non-overlapping passages that fit the token budget for num_questions questions."""
+    budget = budget or context_budget(num_questions)
+    # Highest retrieval score first; passages without a score keep their retrieval order after scored ones
+    ranked = sorted(
+        (r for r in results if r.get('text')),
+        key=lambda r: r['score'] if r.get('score') is not None else float('-inf'),
+        reverse=True,
+    )
+
+    near_filter = NearDuplicateFilter(PASSAGE_OVERLAP_THRESHOLD)
+    packed, used_tokens = [], 0
+    for result in ranked:
+        text = result['text'].strip()
+        if any(text in kept for kept in packed):
+            continue
+        tokens = count_tokens(text)
+        if used_tokens + tokens > budget:
+            # Skip passages that do not fit; a shorter, lower-ranked one may still fit
+            continue
+        if not near_filter.add(text):
+            continue
+        packed.append(text)
+        used_tokens += tokens
+    return packed
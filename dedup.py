@@ -0,0 +1,63 @@
+import re
+import zlib
+
+import numpy as np
+
+_MERSENNE_PRIME = (1 << 31) - 1
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by does for from how in is it of on or that the this to was were what when where which who why with".split()
+)
+
+
+def shingles(text: str) -> set:
+    """Word unigrams and bigrams of the normalized text, ignoring stopwords."""
+    tokens = [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+    return set(tokens) | {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+
+
+class NearDuplicateFilter:
+    """Incremental MinHash filter that rejects texts too similar to ones already accepted."""
+
+    def __init__(self, threshold: float = 0.5, num_perm: int = 128, seed: int = 7):
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._signatures = np.empty((0, num_perm), dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles(text)] or [0], dtype=np.uint64)
+        # Universal hashing (a * h + b) mod p for every permutation at once; a, b < 2**31 and h < 2**32 keep it within uint64
+        return ((self._a * hashes[np.newaxis, :] + self._b) % _MERSENNE_PRIME).min(axis=1)
+
+    def similarities(self, text: str) -> np.ndarray:
+        """Estimated Jaccard similarity of text to every accepted text."""
+        return (self._signatures == self.signature(text)).mean(axis=1)
+
+    def add(self, text: str) -> bool:
+        """Accepts text unless it is a near-duplicate of an accepted one; returns whether it was accepted."""
+        signature = self.signature(text)
+        if len(self._signatures) and (self._signatures == signature).mean(axis=1).max() >= self.threshold:
+            return False
+        self._signatures = np.vstack([self._signatures, signature])
+        return True
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+
+def question_fingerprint(question: dict) -> str:
+    """Text used for similarity: the question plus its correct answer."""
+    if 'options' in question:
+        answer = question['options'].get(question.get('answer'), '')
+    else:
+        answer = question.get('correct_answer', '')
+    return f"{question['question']} {answer}"
+
+
+def dedupe_questions(questions: list, threshold: float = 0.5, near_filter: NearDuplicateFilter = None) -> list:
+    """Drops questions whose question and correct answer nearly duplicate an earlier one."""
+    if near_filter is None:
+        near_filter = NearDuplicateFilter(threshold)
+    return [q for q in questions if near_filter.add(question_fingerprint(q))]
@@ -0,0 +1,171 @@
+import importlib
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+from metrics import registry
+
+# Longest a single completion may take, in seconds, hedges included
+GENERATION_DEADLINE = float(os.getenv('GENERATION_DEADLINE', 90))
+# Start a second, identical request once the first has run longer than this latency quantile
+GENERATION_HEDGE = os.getenv('GENERATION_HEDGE', '1').lower() in ('1', 'true', 'yes')
+HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', 0.95))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+# At most this share of recent completions may be hedged, so a slowdown cannot double the load
+HEDGE_MAX_SHARE = float(os.getenv('HEDGE_MAX_SHARE', 0.05))
+HEDGE_WINDOW = 200
+HEDGE_WORKERS = int(os.getenv('HEDGE_WORKERS', 16))
+# Quizzes up to this many questions in total may be routed to one of FAST_MODELS (none by default)
+SMALL_QUIZ_QUESTIONS = int(os.getenv('SMALL_QUIZ_QUESTIONS', 5))
+FAST_MODELS = [m.strip() for m in os.getenv('FAST_MODELS', '').split(',') if m.strip()]
+ROUTING_MIN_SAMPLES = int(os.getenv('ROUTING_MIN_SAMPLES', 5))
+# Share of routed quizzes sent to a random candidate, so a model that lost keeps fresh latency samples
+ROUTING_EXPLORE_RATE = float(os.getenv('ROUTING_EXPLORE_RATE', 0.05))
+
+
+class GenerationTimeout(TimeoutError):
+    pass
+
+
+class GenerationBackend:
+    """A chat-completions provider; complete() takes OpenAI-style arguments and must honour timeout."""
+
+    def complete(self, timeout: float, **kwargs):
+        raise NotImplementedError
+
+
+class OpenAIBackend(GenerationBackend):
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # The openai package is only imported on first use
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI()
+            return self._client
+
+    def complete(self, timeout: float, **kwargs):
+        return self.client.chat.completions.create(timeout=timeout, **kwargs)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_generation_backend() -> GenerationBackend:
+    """Returns the process-wide backend named by GENERATION_BACKEND ("module:Class"), OpenAI by default."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = os.getenv('GENERATION_BACKEND')
+            if name:
+                module_name, class_name = name.split(":")
+                _backend = getattr(importlib.import_module(module_name), class_name)()
+            else:
+                _backend = OpenAIBackend()
+        return _backend
+
+
+def latency_stage(model: str, expected_completion_tokens: int) -> str:
+    """Metrics stage holding completion latencies for a model and a power-of-two completion size."""
+    size = 2 ** max(8, math.ceil(math.log2(max(expected_completion_tokens, 1))))
+    return f"completion_latency:{model}:{size}"
+
+
+def route_model(default_model: str, num_questions: int, expected_completion_tokens: int) -> str:
+    """Chooses the model for a whole quiz of num_questions questions; call it once per quiz, not per request.
+
+    Quizzes larger than SMALL_QUIZ_QUESTIONS, or any quiz when FAST_MODELS is empty, use default_model.
+    Otherwise the candidate with the lowest observed p95 at expected_completion_tokens (the size of the
+    quiz's largest single request) wins. Candidates without ROUTING_MIN_SAMPLES samples are tried first,
+    default_model before the fast models, and ROUTING_EXPLORE_RATE of quizzes go to a random candidate.
+    """
+    if num_questions > SMALL_QUIZ_QUESTIONS or not FAST_MODELS:
+        return default_model
+
+    candidates = [default_model] + [m for m in FAST_MODELS if m != default_model]
+    if random.random() < ROUTING_EXPLORE_RATE:
+        return random.choice(candidates)
+
+    def observed_p95(model):
+        p95 = registry.quantile(latency_stage(model, expected_completion_tokens), 0.95, ROUTING_MIN_SAMPLES)
+        return -1.0 if p95 is None else p95
+
+    return min(candidates, key=observed_p95)
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="completion")
+_hedge_lock = threading.Lock()
+# The most recent calls (0) and hedges (1), HEDGE_WINDOW entries at most
+_hedge_history = deque(maxlen=HEDGE_WINDOW)
+_hedge_in_flight = 0
+
+
+def _submit(fn: Callable):
+    global _hedge_in_flight
+    with _hedge_lock:
+        _hedge_in_flight += 1
+    future = _hedge_executor.submit(fn)
+    future.add_done_callback(_finished)
+    return future
+
+
+def _finished(future):
+    global _hedge_in_flight
+    with _hedge_lock:
+        _hedge_in_flight -= 1
+
+
+def _claim_hedge() -> bool:
+    """Takes a hedge from the HEDGE_MAX_SHARE budget, unless it is spent or the pool is half busy."""
+    with _hedge_lock:
+        # Hedges only use idle workers, so primaries never queue behind them
+        if _hedge_in_flight * 2 > HEDGE_WORKERS:
+            return False
+        hedges = sum(_hedge_history)
+        if hedges + 1 > HEDGE_MAX_SHARE * (len(_hedge_history) - hedges):
+            return False
+        _hedge_history.append(1)
+        return True
+
+
+def call_with_hedge(fn: Callable, hedge_after: Optional[float], deadline: float, can_hedge: Optional[Callable[[], bool]] = None):
+    """Runs fn() and, if it has not returned after hedge_after seconds, a second fn(); the first success wins.
+
+    The hedge is skipped when can_hedge() returns False (e.g. the caller's rate limiter has a queue), when
+    HEDGE_MAX_SHARE of recent calls were already hedged, or when half the workers are busy. Raises
+    GenerationTimeout once deadline seconds pass without a result. The losing request is not interrupted;
+    it finishes in the background within its own timeout.
+    """
+    started = time.monotonic()
+    with _hedge_lock:
+        _hedge_history.append(0)
+    pending = {_submit(fn)}
+    hedged = hedge_after is None
+    error = None
+    while True:
+        elapsed = time.monotonic() - started
+        if elapsed >= deadline:
+            raise GenerationTimeout(f"No completion within {deadline}s")
+        timeout = deadline - elapsed if hedged else min(deadline, hedge_after) - elapsed
+        done, pending = wait(pending, timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        if not pending:
+            raise error
+        if not hedged and time.monotonic() - started >= hedge_after:
+            hedged = True
+            if (can_hedge is None or can_hedge()) and _claim_hedge():
+                registry.record_value("completion_hedge", time.monotonic() - started)
+                pending.add(_submit(fn))
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from metrics import span
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """A unit of background work; the worker reports partial results through add_progress."""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._progress = []
+        self._lock = threading.Lock()
+        # Passed to long-running work so it can stop between steps
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Raises JobCancelled if cancellation was requested; workers call this between steps."""
+        if self.cancel_requested:
+            raise JobCancelled(self.id)
+
+    def add_progress(self, item):
+        with self._lock:
+            self._progress.append(item)
+
+    @property
+    def progress(self) -> list:
+        with self._lock:
+            return list(self._progress)
+
+    def cancel(self):
+        self.cancel_event.set()
+        # A job still waiting in the queue is dropped outright; a running one stops at its next check
+        if self.future is not None and self.future.cancel():
+            self.status = CANCELLED
+            self.finished_at = time.time()
+
+
+class JobQueue:
+    """Runs jobs on a bounded worker pool so long generations and uploads never block a script run."""
+
+    def __init__(self, max_workers: int = 4, retention: float = 3600.0):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable, *args, **kwargs) -> Job:
+        """Queues fn(job, *args, **kwargs) and returns its Job straight away."""
+        job = Job(kind)
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job, fn, *args, **kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel()
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _run(self, job: Job, fn: Callable, *args, **kwargs):
+        if job.cancel_requested:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            with span("job", kind=job.kind, queued_seconds=round(job.started_at - job.created_at, 3)):
+                job.result = fn(job, *args, **kwargs)
+            job.status = SUCCEEDED
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            print(f"Job {job.kind} {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+
+    def _prune_locked(self):
+        # Sessions that never came back for their results must not keep them in memory forever
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Returns the process-wide job queue, sized by JOB_WORKERS."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(
+                max_workers=int(os.getenv('JOB_WORKERS', 4)),
+                retention=float(os.getenv('JOB_RETENTION_SECONDS', 3600)),
+            )
+        return _job_queue
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from question_bank import EMBEDDING_DIM, chunk_text, hash_embedding
+
+
+def _load_faiss():
+    try:
+        import faiss
+        return faiss
+    except ImportError:  # faiss is optional; searches fall back to a numpy scan of the mapped vectors
+        print("faiss is not installed; the local index falls back to a numpy scan")
+        return None
+
+
+class LocalIndex:
+    """On-disk mirror of indexed documents, searchable without a round-trip to Vectara.
+
+    Passage text lives in SQLite and the embeddings in a raw float32 file that is memory-mapped for
+    reads and scanned with numpy, so opening a large index costs no up-front load. With use_faiss, a
+    faiss inner-product index holds an in-memory copy of the vectors instead; new passages are added
+    to it incrementally.
+    """
+
+    def __init__(self, path: str, chunk_words: int = 120, use_faiss: bool = False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_words = chunk_words
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, "passages.sqlite"), check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS passages (
+                id INTEGER PRIMARY KEY,
+                doc_id TEXT,
+                text TEXT,
+                deleted INTEGER DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS passages_doc ON passages (doc_id);
+            """
+        )
+        self._db.commit()
+        self._faiss = _load_faiss() if use_faiss else None
+        self._vectors = None
+        self._faiss_index = None
+        self._live = None
+        self._load_locked()
+
+    def _map_vectors(self, rows: int):
+        if rows:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, EMBEDDING_DIM))
+        else:
+            self._vectors = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+    def _load_locked(self):
+        # Rows appended to the vector file after the last commit (a crash mid-add) are ignored
+        count = self._db.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM passages").fetchone()[0]
+        file_rows = os.path.getsize(self.vectors_path) // (4 * EMBEDDING_DIM) if os.path.exists(self.vectors_path) else 0
+        rows = min(count, file_rows)
+        self._map_vectors(rows)
+        live = np.zeros(rows, dtype=bool)
+        for (passage_id,) in self._db.execute("SELECT id FROM passages WHERE deleted = 0 AND id < ?", (rows,)):
+            live[passage_id] = True
+        self._live = live
+        if self._faiss is not None:
+            self._faiss_index = self._faiss.IndexFlatIP(EMBEDDING_DIM)
+            if rows:
+                self._faiss_index.add(np.ascontiguousarray(self._vectors))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._live.sum())
+
+    def add_document(self, doc_id: str, text: str):
+        """Mirrors a document, replacing any passages previously stored for the same doc_id."""
+        passages = [p for p in chunk_text(text or "", self.chunk_words) if p.strip()]
+        with self._lock:
+            self._remove_locked(doc_id)
+            if not passages:
+                self._db.commit()
+                return
+            vectors = np.vstack([hash_embedding(p) for p in passages]).astype(np.float32)
+            start = len(self._vectors)
+            # Truncate any uncommitted tail so file rows and passage ids stay aligned
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(start * 4 * EMBEDDING_DIM)
+                f.write(vectors.tobytes())
+            self._db.executemany(
+                "INSERT INTO passages (id, doc_id, text) VALUES (?, ?, ?)",
+                [(start + i, doc_id, p) for i, p in enumerate(passages)],
+            )
+            self._db.commit()
+            # Remapping is cheap and only the new rows go into faiss, so bulk uploads stay linear
+            self._map_vectors(start + len(passages))
+            self._live = np.concatenate([self._live, np.ones(len(passages), dtype=bool)])
+            if self._faiss_index is not None:
+                self._faiss_index.add(vectors)
+
+    def remove_document(self, doc_id: str):
+        with self._lock:
+            self._remove_locked(doc_id)
+            self._db.commit()
+
+    def _remove_locked(self, doc_id: str):
+        # Vectors are only tombstoned; their rows stay in the file so passage ids never shift
+        for (passage_id,) in self._db.execute("SELECT id FROM passages WHERE doc_id = ? AND deleted = 0", (doc_id,)):
+            if passage_id < len(self._live):
+                self._live[passage_id] = False
+        self._db.execute("UPDATE passages SET deleted = 1 WHERE doc_id = ?", (doc_id,))
+
+    def search(self, query: str, num_results: int = 10, min_score: float = 0.05) -> List[dict]:
+        """Returns up to num_results {'text', 'score'} passages ranked by cosine similarity to the query."""
+        query_vector = hash_embedding(query)
+        with self._lock:
+            if not self._live.any():
+                return []
+            if self._faiss_index is not None:
+                # Ask for extra hits so tombstoned passages do not leave the result short
+                k = min(len(self._live), num_results + int((~self._live).sum()))
+                scores, ids = self._faiss_index.search(query_vector[None, :], k)
+                hits = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i >= 0 and self._live[i]]
+            else:
+                scores = np.asarray(self._vectors @ query_vector)
+                scores[~self._live] = -1.0
+                top = np.argpartition(-scores, num_results - 1)[:num_results] if len(scores) > num_results else np.arange(len(scores))
+                top = top[np.argsort(-scores[top])]
+                hits = [(int(i), float(scores[i])) for i in top]
+            hits = [(i, s) for i, s in hits if s >= min_score][:num_results]
+            if not hits:
+                return []
+            placeholders = ",".join("?" * len(hits))
+            texts = dict(self._db.execute(f"SELECT id, text FROM passages WHERE id IN ({placeholders})", [i for i, _ in hits]))
+        return [{'text': texts[i], 'score': score} for i, score in hits]
+
+
+_local_index = None
+_local_index_lock = threading.Lock()
+
+
+def get_local_index() -> Optional[LocalIndex]:
+    """Returns the process-wide local index, or None unless LOCAL_INDEX_PATH is set."""
+    global _local_index
+    path = os.getenv('LOCAL_INDEX_PATH')
+    if not path:
+        return None
+    with _local_index_lock:
+        if _local_index is None:
+            _local_index = LocalIndex(
+                path,
+                chunk_words=int(os.getenv('LOCAL_INDEX_CHUNK_WORDS', 120)),
+                use_faiss=os.getenv('LOCAL_INDEX_FAISS', '').lower() in ('1', 'true', 'yes'),
+            )
+        return _local_index
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(fileobj) -> Tuple[str, int]:
+    """SHA-256 and size of a file object's contents, read in chunks; the file position is restored afterwards."""
+    start = fileobj.tell()
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(start)
+    return digest.hexdigest(), size
+
+
+class IndexManifest:
+    """Local record of which document content has already been indexed into each corpus."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    def is_unchanged(self, corpus_id, doc_id: str, digest: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(str(corpus_id), {}).get(doc_id)
+            return entry is not None and entry["sha256"] == digest
+
+    def record(self, corpus_id, doc_id: str, digest: str, size: int):
+        with self._lock:
+            self._entries.setdefault(str(corpus_id), {})[doc_id] = {
+                "sha256": digest,
+                "size": size,
+                "indexed_at": time.time(),
+            }
+            self._save_locked()
+
+    def forget(self, corpus_id, doc_id: str):
+        with self._lock:
+            if self._entries.get(str(corpus_id), {}).pop(doc_id, None) is not None:
+                self._save_locked()
+
+    def _save_locked(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file and rename so a crash never leaves a truncated manifest
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_index_manifest() -> Optional[IndexManifest]:
+    """Returns the process-wide manifest, or None when INDEX_MANIFEST_PATH is set to an empty value."""
+    global _manifest
+    path = os.getenv('INDEX_MANIFEST_PATH', os.path.join('.cache', 'index_manifest.json'))
+    if not path:
+        return None
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = IndexManifest(path)
+        return _manifest
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("quiz.metrics")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Span attributes that are summed into counters, e.g. span.set(prompt_tokens=120)
+COUNTED_ATTRIBUTES = ("bytes", "prompt_tokens", "completion_tokens")
+
+
+class Span:
+    """A timed stage; attributes set on it are exported with its duration."""
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class MetricsRegistry:
+    """Process-wide store of stage durations, counters and recent spans."""
+
+    def __init__(self, recent: int = 200):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(list)
+        self._bucket_counts = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self._counters = defaultdict(float)
+        self._sums = defaultdict(float)
+        self.recent_spans = deque(maxlen=recent)
+        self.log_spans = os.getenv('METRICS_LOG', '').lower() in ('1', 'true', 'yes')
+
+    def record(self, span: Span):
+        with self._lock:
+            durations = self._durations[span.name]
+            durations.append(span.duration)
+            self._sums[span.name] += span.duration
+            if len(durations) > 10000:
+                # Keep memory bounded; quantiles only need a recent window
+                del durations[:5000]
+            buckets = self._bucket_counts[span.name]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    buckets[i] += 1
+            self._counters[("stage_calls_total", span.name, "")] += 1
+            if span.error:
+                self._counters[("stage_errors_total", span.name, "")] += 1
+            for key in COUNTED_ATTRIBUTES:
+                if isinstance(span.attributes.get(key), (int, float)):
+                    self._counters[(f"{key}_total", span.name, "")] += span.attributes[key]
+            if "cache_hit" in span.attributes:
+                outcome = "hit" if span.attributes["cache_hit"] else "miss"
+                self._counters[("cache_lookups_total", span.name, outcome)] += 1
+            self.recent_spans.append({
+                "stage": span.name,
+                "start": span.start,
+                "duration": span.duration,
+                "error": span.error,
+                **span.attributes,
+            })
+        if self.log_spans:
+            logger.info(json.dumps({"stage": span.name, "duration": round(span.duration, 6), "error": span.error, **span.attributes}, default=str))
+
+    def record_value(self, name: str, duration: float, **attributes):
+        """Records a stage whose duration was measured elsewhere, e.g. an HTTP response's elapsed time."""
+        current = Span(name, attributes)
+        current.duration = duration
+        self.record(current)
+
+    def quantile(self, name: str, fraction: float, min_samples: int = 1):
+        """Latency quantile of a stage over its recent window, or None with fewer than min_samples calls."""
+        with self._lock:
+            durations = self._durations.get(name)
+            if not durations or len(durations) < min_samples:
+                return None
+            ordered = sorted(durations)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def stage_summary(self) -> list:
+        """Per-stage call count and latency quantiles, for the admin panel."""
+        with self._lock:
+            rows = []
+            for name, durations in sorted(self._durations.items()):
+                ordered = sorted(durations)
+                rows.append({
+                    "stage": name,
+                    "calls": int(self._counters.get(("stage_calls_total", name, ""), 0)),
+                    "errors": int(self._counters.get(("stage_errors_total", name, ""), 0)),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                    "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+                    "max_ms": round(ordered[-1] * 1000, 1),
+                    "prompt_tokens": int(self._counters.get(("prompt_tokens_total", name, ""), 0)),
+                    "completion_tokens": int(self._counters.get(("completion_tokens_total", name, ""), 0)),
+                    "bytes": int(self._counters.get(("bytes_total", name, ""), 0)),
+                })
+            return rows
+
+    def render_prometheus(self) -> str:
+        """Exports everything in the Prometheus text exposition format."""
+        lines = ["# TYPE quiz_stage_duration_seconds histogram"]
+        with self._lock:
+            for name in sorted(self._durations):
+                calls = int(self._counters.get(("stage_calls_total", name, ""), 0))
+                for bound, count in zip(DURATION_BUCKETS, self._bucket_counts[name]):
+                    lines.append(f'quiz_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'quiz_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {calls}')
+                lines.append(f'quiz_stage_duration_seconds_sum{{stage="{name}"}} {self._sums[name]}')
+                lines.append(f'quiz_stage_duration_seconds_count{{stage="{name}"}} {calls}')
+            for (metric, stage, outcome), value in sorted(self._counters.items()):
+                labels = f'stage="{stage}"' + (f',outcome="{outcome}"' if outcome else "")
+                lines.append(f"quiz_{metric}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Times a stage and records it, e.g. `with span("vectara_query") as s: ...; s.set(cache_hit=True)`."""
+    current = Span(name, attributes)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        registry.record(current)
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server():
+    """Serves /metrics for Prometheus on METRICS_PORT, once per process; does nothing if it is unset."""
+    global _metrics_server
+    port = os.getenv('METRICS_PORT')
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+        return _metrics_server
@@ -0,0 +1,108 @@
+import ast
+import json
+
+
+def parse_object(text: str):
+    """Parses a single JSON object, tolerating the single-quoted Python-style dicts the model sometimes emits."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        value = ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+class IncrementalQuestionParser:
+    """Incrementally scans a streamed completion and returns each question object as soon as it closes.
+
+    Question objects are the objects that are direct children of the top-level array, or of an array
+    directly inside the top-level object (e.g. {"questions-data": [{...}, {...}]}).
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.stack = []
+        self.quote = None
+        self.escaped = False
+        self.object_start = None
+        self.position = 0
+
+    def feed(self, chunk: str) -> list:
+        """Consumes the next chunk of text and returns the question objects completed by it."""
+        completed = []
+        for char in chunk:
+            self.buffer.append(char)
+            if self.quote:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == self.quote:
+                    self.quote = None
+            elif char in ('"', "'") and self.stack:
+                self.quote = char
+            elif char in '{[':
+                if char == '{' and self._at_question_level():
+                    self.object_start = self.position
+                self.stack.append(char)
+            elif char in '}]' and self.stack:
+                self.stack.pop()
+                if char == '}' and self.object_start is not None and self._at_question_level():
+                    obj = parse_object(''.join(self.buffer[self.object_start:]))
+                    if obj is not None:
+                        completed.append(obj)
+                    self.object_start = None
+            self.position += 1
+        return completed
+
+    def _at_question_level(self) -> bool:
+        return self.stack == ['['] or self.stack == ['{', '[']
+
+    @property
+    def text(self) -> str:
+        """The full text received so far."""
+        return ''.join(self.buffer)
+
+
+REQUIRED_QUESTION_KEYS = ('question', 'correct_answer', 'distractor1', 'distractor2', 'distractor3', 'support')
+
+
+def salvage_questions(text: str) -> list:
+    """Returns every well-formed question object in a completion, even if the completion as a whole is broken."""
+    start = min((i for i in (text.find('{'), text.find('[')) if i >= 0), default=-1)
+    if start >= 0:
+        whole = parse_object(text[start:].strip().rstrip('`').strip()) if text[start] == '{' else None
+        if isinstance(whole, dict) and isinstance(whole.get('questions-data'), list):
+            return [item for item in whole['questions-data'] if isinstance(item, dict)]
+        if isinstance(whole, dict) and 'question' in whole:
+            return [whole]
+    parser = IncrementalQuestionParser()
+    return parser.feed(text)
+
+
+def validate_question(item) -> str:
+    """Returns the reason a generated question is unusable, or an empty string if it is valid."""
+    if not isinstance(item, dict):
+        return "not an object"
+    for key in REQUIRED_QUESTION_KEYS:
+        if not isinstance(item.get(key), str) or not item[key].strip():
+            return f"missing or empty '{key}'"
+    options = [item['correct_answer'], item['distractor1'], item['distractor2'], item['distractor3']]
+    if len({option.strip().lower() for option in options}) != len(options):
+        return "options are not distinct"
+    return ""
+
+
+def split_valid_questions(items: list):
+    """Splits parsed items into (valid questions, list of rejection reasons)."""
+    valid, rejected = [], []
+    for item in items:
+        reason = validate_question(item)
+        if reason:
+            rejected.append(reason)
+        else:
+            valid.append(item)
+    return valid, rejected
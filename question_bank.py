@@ -0,0 +1,201 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from dedup import STOPWORDS, TOKEN_PATTERN, shingles
+
+EMBEDDING_DIM = 512
+
+
+def hash_embedding(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Cheap local embedding: L2-normalized hashed bag of word unigrams and bigrams."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for shingle in shingles(text):
+        vector[zlib.crc32(shingle.encode("utf-8")) % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def top_keywords(text: str, limit: int = 10) -> List[str]:
+    tokens = [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS and len(t) > 2 and not t.isdigit()]
+    return [word for word, _ in Counter(tokens).most_common(limit)]
+
+
+def chunk_text(text: str, max_words: int = 400) -> List[str]:
+    """Splits a document into chunks of roughly max_words words, keeping paragraphs together where possible."""
+    chunks, current, current_words = [], [], 0
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        if not paragraph:
+            continue
+        words = len(paragraph.split())
+        if current and current_words + words > max_words:
+            chunks.append("\n\n".join(current))
+            current, current_words = [], 0
+        current.append(paragraph)
+        current_words += words
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class QuestionBank:
+    """SQLite store of pre-generated questions, searchable by document, keywords and embedding."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                doc_id TEXT,
+                chunk_index INTEGER,
+                embedding BLOB,
+                question TEXT,
+                created_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS questions_doc ON questions (doc_id);
+            CREATE TABLE IF NOT EXISTS question_keywords (keyword TEXT, question_id INTEGER);
+            CREATE INDEX IF NOT EXISTS question_keywords_keyword ON question_keywords (keyword);
+            """
+        )
+        self._db.commit()
+        self._ids = None
+        self._embeddings = None
+
+    def has_document(self, doc_id: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM questions WHERE doc_id = ? LIMIT 1", (doc_id,)).fetchone() is not None
+
+    def remove_document(self, doc_id: str):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM question_keywords WHERE question_id IN (SELECT id FROM questions WHERE doc_id = ?)", (doc_id,)
+            )
+            self._db.execute("DELETE FROM questions WHERE doc_id = ?", (doc_id,))
+            self._db.commit()
+            self._embeddings = None
+
+    def add_questions(self, doc_id: str, chunk_index: int, chunk: str, questions: List[dict]):
+        """Stores raw generated questions for one chunk of a document."""
+        keywords = top_keywords(chunk)
+        with self._lock:
+            for question in questions:
+                embedding = hash_embedding(f"{chunk}\n{question['question']}")
+                cursor = self._db.execute(
+                    "INSERT INTO questions (doc_id, chunk_index, embedding, question, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (doc_id, chunk_index, embedding.tobytes(), json.dumps(question, ensure_ascii=False), time.time()),
+                )
+                question_keywords = set(keywords) | set(top_keywords(question['question']))
+                self._db.executemany(
+                    "INSERT INTO question_keywords (keyword, question_id) VALUES (?, ?)",
+                    [(keyword, cursor.lastrowid) for keyword in question_keywords],
+                )
+            self._db.commit()
+            self._embeddings = None
+
+    def _load_embeddings(self):
+        if self._embeddings is None:
+            rows = self._db.execute("SELECT id, embedding FROM questions").fetchall()
+            self._ids = np.array([row[0] for row in rows], dtype=np.int64)
+            self._embeddings = (
+                np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                if rows else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+            )
+        return self._ids, self._embeddings
+
+    def lookup(self, query: str, limit: int, min_score: float = 0.1) -> List[dict]:
+        """Samples up to limit questions relevant to the query, or fewer if the bank is thin on the topic."""
+        query_keywords = top_keywords(query) or [t for t in TOKEN_PATTERN.findall(query.lower())]
+        with self._lock:
+            ids, embeddings = self._load_embeddings()
+            if not len(ids):
+                return []
+            scores = embeddings @ hash_embedding(query)
+            if query_keywords:
+                placeholders = ",".join("?" * len(query_keywords))
+                keyword_hits = dict(self._db.execute(
+                    f"SELECT question_id, COUNT(*) FROM question_keywords WHERE keyword IN ({placeholders}) GROUP BY question_id",
+                    query_keywords,
+                ).fetchall())
+                scores = scores + np.array([keyword_hits.get(int(i), 0) for i in ids], dtype=np.float32) / len(query_keywords)
+            ranked = np.argsort(-scores)
+            candidates = [int(ids[i]) for i in ranked[:limit * 3] if scores[i] >= min_score]
+            # Sample from the best candidates so repeated quizzes on a topic are not identical
+            chosen = random.sample(candidates, min(limit, len(candidates)))
+            if not chosen:
+                return []
+            placeholders = ",".join("?" * len(chosen))
+            rows = self._db.execute(f"SELECT question FROM questions WHERE id IN ({placeholders})", chosen).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class QuestionBankBuilder:
+    """Pre-generates questions for newly indexed documents on a background thread pool."""
+
+    def __init__(self, bank: QuestionBank, generate_fn: Callable[[str, int], List[dict]], questions_per_chunk: int = 5, max_workers: int = 2):
+        self.bank = bank
+        self.generate_fn = generate_fn
+        self.questions_per_chunk = questions_per_chunk
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="question-bank")
+
+    def submit(self, doc_id: str, text: str):
+        """Queues a document for question generation; returns immediately."""
+        if text and text.strip():
+            return self.executor.submit(self._build, doc_id, text)
+        return None
+
+    def _build(self, doc_id: str, text: str):
+        # Re-indexing a document replaces its questions
+        self.bank.remove_document(doc_id)
+        for chunk_index, chunk in enumerate(chunk_text(text)):
+            try:
+                questions = self.generate_fn(chunk, self.questions_per_chunk)
+            except Exception as e:
+                print(f"Question bank generation failed for {doc_id} chunk {chunk_index}: {e}")
+                continue
+            self.bank.add_questions(doc_id, chunk_index, chunk, questions)
+
+
+_question_bank = None
+_question_bank_builder = None
+_question_bank_lock = threading.Lock()
+
+
+def get_question_bank() -> Optional[QuestionBank]:
+    """Returns the process-wide question bank, or None unless QUESTION_BANK_PATH is set."""
+    global _question_bank
+    path = os.getenv('QUESTION_BANK_PATH')
+    if not path:
+        return None
+    with _question_bank_lock:
+        if _question_bank is None:
+            _question_bank = QuestionBank(path)
+        return _question_bank
+
+
+def get_question_bank_builder(generate_fn: Callable[[str, int], List[dict]]) -> Optional[QuestionBankBuilder]:
+    """Returns the process-wide background builder for the question bank, if the bank is enabled."""
+    global _question_bank_builder
+    bank = get_question_bank()
+    if bank is None:
+        return None
+    with _question_bank_lock:
+        if _question_bank_builder is None:
+            _question_bank_builder = QuestionBankBuilder(
+                bank, generate_fn, questions_per_chunk=int(os.getenv('QUESTION_BANK_PER_CHUNK', 5))
+            )
+        return _question_bank_builder
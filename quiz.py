@@ -0,0 +1,651 @@
+from vectara import Searching
+import json
+import re
+import os
+import random
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from cache import get_generation_cache
+from dedup import NearDuplicateFilter, dedupe_questions, question_fingerprint
+from question_bank import get_question_bank
+from local_index import get_local_index
+from context_packing import count_tokens, pack_context, reciprocal_rank_fusion
+from jobs import JobCancelled
+from generation import GENERATION_DEADLINE, GENERATION_HEDGE, HEDGE_MIN_SAMPLES, HEDGE_QUANTILE, call_with_hedge, get_generation_backend, latency_stage, route_model
+from metrics import registry, span
+from scheduler import SingleFlight, estimate_tokens, get_openai_limiter
+from parsing import IncrementalQuestionParser, parse_object, salvage_questions, split_valid_questions, validate_question
+
+# Bump these whenever the corresponding prompt changes so cached generations are not reused
+QUESTION_PROMPT_VERSION = "1"
+QUESTIONS_DATA_PROMPT_VERSION = "1"
+QUERY_VARIANTS_PROMPT_VERSION = "1"
+
+QUESTIONS_DATA_MODEL = "gpt-4"
+QUESTIONS_DATA_TEMPERATURE = 0.1
+# How many follow-up completions may be spent regenerating missing or invalid questions
+QUESTION_REGENERATION_ATTEMPTS = int(os.getenv('QUESTION_REGENERATION_ATTEMPTS', 1))
+# Estimated Jaccard similarity of question + correct answer above which two questions count as duplicates
+DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', 0.5))
+# Rough completion size per question, used to budget tokens before a request is sent
+COMPLETION_TOKENS_PER_QUESTION = 150
+# Alternative phrasings of the topic searched alongside it; 0 (the default) searches the topic alone
+MULTI_QUERY_VARIANTS = int(os.getenv('MULTI_QUERY_VARIANTS', 0))
+QUERY_VARIANTS_MODEL = "gpt-3.5-turbo"
+# Seconds to wait for the variants to be written before searching with the topic alone
+QUERY_VARIANTS_TIMEOUT = float(os.getenv('QUERY_VARIANTS_TIMEOUT', 2))
+# vectara: hosted search only; local: the local mirror first, Vectara only when it finds too little;
+# fallback: Vectara, switching to the local mirror when it fails or exceeds VECTARA_QUERY_TIMEOUT;
+# hybrid: both at once, fused by rank. Modes other than vectara need LOCAL_INDEX_PATH.
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'vectara')
+VECTARA_QUERY_TIMEOUT = float(os.getenv('VECTARA_QUERY_TIMEOUT', 5))
+LOCAL_MIN_RESULTS = int(os.getenv('LOCAL_MIN_RESULTS', 3))
+
+# How often waits on generation wake up to check for cancellation, in seconds
+CANCEL_POLL_INTERVAL = 0.2
+
+_generation_flight = SingleFlight()
+_query_flight = SingleFlight()
+# Vectara queries that may be abandoned on timeout run here, so the caller does not wait for them
+_retrieval_executor = ThreadPoolExecutor(max_workers=int(os.getenv('RETRIEVAL_WORKERS', 8)), thread_name_prefix="retrieval")
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_searcher():
+    """Returns the shared Searching client, created on first use so callers can set up the environment first."""
+    with _clients_lock:
+        if 'searcher' not in _clients:
+            _clients['searcher'] = Searching()
+        return _clients['searcher']
+
+def create_chat_completion(expected_completion_tokens, **kwargs):
+    """Calls the generation backend within the shared rate-limit budget, hedging slow non-streamed calls."""
+    limiter = get_openai_limiter()
+    estimated_tokens = estimate_tokens(''.join(m['content'] for m in kwargs['messages'])) + expected_completion_tokens
+    stream = bool(kwargs.get('stream'))
+    stage = latency_stage(kwargs['model'], expected_completion_tokens)
+
+    def attempt():
+        if limiter:
+            with span("openai_rate_limit_wait"):
+                limiter.acquire(estimated_tokens)
+        # For streamed calls this only covers the time until the stream opens; the consumer times the rest
+        with span("openai_completion", model=kwargs['model'], stream=stream) as current:
+            response = get_generation_backend().complete(timeout=GENERATION_DEADLINE, **kwargs)
+            usage = getattr(response, 'usage', None)
+            if usage:
+                current.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        if not stream:
+            registry.record_value(stage, current.duration)
+        if limiter and usage:
+            limiter.reconcile(estimated_tokens, usage.total_tokens)
+        return response
+
+    if stream or not GENERATION_HEDGE:
+        return attempt()
+    # A hedge would only join the queue of a backed-up limiter
+    can_hedge = (lambda: limiter.waiting == 0) if limiter else None
+    return call_with_hedge(attempt, registry.quantile(stage, HEDGE_QUANTILE, HEDGE_MIN_SAMPLES), GENERATION_DEADLINE, can_hedge)
+
+def generate_question_and_options(document):
+    system_prompt = """
+    Your task is to analyze the provided text and extract essential elements to create a multiple-choice question with one correct answer and three incorrect options (distractors). Additionally, you are to provide a support explanation that justifies why the correct answer is right.
+
+    Please format the output as a JSON object that includes:
+    - A 'question' key with a clear, well-formed question derived from the text.
+    - Three 'distractor' keys labeled 'distractor1', 'distractor2', and 'distractor3', each containing a plausible but incorrect answer.
+    - A 'correct_answer' key containing the accurate answer to the question.
+    - A 'support' key containing an explanation or reasoning that supports the correctness of the provided answer.
+
+    Here is a sample json as an example for the generated output, example: 
+    {'question': 'What phenomenon makes global winds blow northeast to southwest or the reverse in the northern hemisphere and northwest to southeast or the reverse in the southern hemisphere?', 
+     'distractor3': 'first option', 
+     'distractor1': 'second option',
+     'distractor2': 'third option',
+     'correct_answer': 'the correct answer',
+     'support': 'Without Coriolis Effect the global winds would blow north to south or south to north. But Coriolis makes them blow northeast to southwest or the reverse in the Northern Hemisphere. The winds blow northwest to southeast or the reverse in the southern hemisphere.'} 
+
+    Ensure the information is accurate, relevant, and directly derived from the provided text. Avoid introducing external facts not supported by the text. This task requires precision and attention to detail in reading comprehension and data presentation.
+    """
+
+    user_prompt = f"""Please read the following text and extract information to form a multiple choice question with one correct answer and three distractors. Also, provide a support explanation for the correct answer.
+    Format the output as a JSON object with keys for 'question', 'distractor1', 'distractor2', 'distractor3', 'correct_answer', and 'support'. 
+    
+    Context:
+    {document}
+    
+    Answer:
+    """
+
+    model = route_model("gpt-4-turbo-preview", 1, COMPLETION_TOKENS_PER_QUESTION)
+    temperature = 0
+    cache = get_generation_cache()
+    cache_key = cache.make_key(model, QUESTION_PROMPT_VERSION, temperature, document, 1) if cache else None
+    result = cache.get(cache_key) if cache else None
+
+    # try:
+    if result is None:
+        response = create_chat_completion(
+            COMPLETION_TOKENS_PER_QUESTION,
+            model=model,
+            temperature=temperature,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ])
+        
+        # Parse the response to get the JSON object
+        result = json.loads(response.choices[0].message.content)
+        if cache:
+            cache.set(cache_key, result)
+
+    # Options are shuffled on every serve, including cache hits
+    return shuffle_question(result)
+
+    # except Exception as e:
+    #     print(f"An error occurred: {e}")
+    #     return {}
+
+def build_questions_messages(context, questionsNo, exclude_questions=None):
+    """Builds the chat messages asking the model for questionsNo questions over the context."""
+    system_prompt = """
+    Your task is to analyze the provided text and extract essential elements to create multiple-choice questions with one correct answer and three incorrect options (distractors). Additionally, you are to provide a support explanation that justifies why the correct answer is right.
+
+    Please format the output JSON object which has a parent key 'questions-data' which has array of JSON objects where each child JSON object includes:
+    - A 'question' key with a clear, well-formed question derived from the text.
+    - Three 'distractor' keys labeled 'distractor1', 'distractor2', and 'distractor3', each containing a plausible but incorrect answer.
+    - A 'correct_answer' key containing the accurate answer to the question.
+    - A 'support' key containing an explanation or reasoning that supports the correctness of the provided answer.
+
+    Here is a sample json as an example for the generated output, example: 
+    {'questions-data': [{'question': 'What phenomenon makes global winds blow northeast to southwest or the reverse in the northern hemisphere and northwest to southeast or the reverse in the southern hemisphere?', 
+     'distractor3': 'first option', 
+     'distractor1': 'second option',
+     'distractor2': 'third option',
+     'correct_answer': 'the correct answer',
+     'support': 'Without Coriolis Effect the global winds would blow north to south or south to north. But Coriolis makes them blow northeast to southwest or the reverse in the Northern Hemisphere. The winds blow northwest to southeast or the reverse in the southern hemisphere.'},
+     {"question": "What is the least dangerous radioactive decay?",
+                                "distractor3": "zeta decay",
+                                "distractor1": "beta decay",
+                                "distractor2": "gamma decay",
+                                "correct_answer": "alpha decay",
+                                "support": "All radioactive decay is dangerous to living things"}]}
+
+    Ensure the information is accurate, relevant, and directly derived from the provided text. Avoid introducing external facts not supported by the text. This task requires precision and attention to detail in reading comprehension and data presentation.
+    Ensure the information is derived directly from the provided text and formatted accurately as a collection of JSON objects.
+    """
+    user_prompt = f"""
+    Based on the following context, extract information to form {questionsNo} distinct multiple choice questions, each with a correct answer and three distractors. Also, provide a supporting explanation for each correct answer.
+    Ensure that the maximum number of the words in the final response does not exceed 8000 words.
+
+    Context:
+    {context}
+    
+    Answer:"""
+    if exclude_questions:
+        # Used when regenerating only the missing questions of an earlier completion
+        user_prompt = "Do not repeat any of these already generated questions:\n" + "\n".join(f"- {q}" for q in exclude_questions) + "\n" + user_prompt
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def route_quiz_model(num_questions):
+    """The model for every completion of a num_questions quiz, routed on the quiz's total size."""
+    largest_request = min(num_questions, int(os.getenv('GENERATION_SHARD_SIZE', 5)))
+    return route_model(QUESTIONS_DATA_MODEL, num_questions, largest_request * COMPLETION_TOKENS_PER_QUESTION)
+
+def request_questions(context, questionsNo, exclude_questions=None, model=QUESTIONS_DATA_MODEL):
+    """Runs one completion and returns every valid question that can be salvaged from it."""
+    response = create_chat_completion(
+        questionsNo * COMPLETION_TOKENS_PER_QUESTION,
+        model=model,
+        temperature=QUESTIONS_DATA_TEMPERATURE,
+        messages=build_questions_messages(context, questionsNo, exclude_questions)
+    )
+
+    with span("parse_completion") as current:
+        questions_list, rejected = split_valid_questions(salvage_questions(response.choices[0].message.content))
+        current.set(valid=len(questions_list), rejected=len(rejected))
+    if rejected:
+        print(f"Discarded {len(rejected)} invalid generated questions: {rejected}")
+    return questions_list
+
+def complete_questions(context, questionsNo, questions_list=None, model=QUESTIONS_DATA_MODEL):
+    """Tops up questions_list to questionsNo valid questions, regenerating only the missing ones."""
+    questions_list = list(questions_list or [])
+    seen_questions = {q['question'].strip().lower() for q in questions_list}
+    attempts = 0
+    while len(questions_list) < questionsNo and attempts <= QUESTION_REGENERATION_ATTEMPTS:
+        missing = questionsNo - len(questions_list)
+        for question_data in request_questions(context, missing, [q['question'] for q in questions_list], model):
+            if question_data['question'].strip().lower() not in seen_questions:
+                seen_questions.add(question_data['question'].strip().lower())
+                questions_list.append(question_data)
+        attempts += 1
+    return questions_list[:questionsNo]
+
+def generate_raw_questions(context, questionsNo, model=QUESTIONS_DATA_MODEL):
+    """Returns the raw (unshuffled) question list for the context, from the cache or a fresh generation."""
+    with span("generate_questions", questions=questionsNo) as current:
+        # An empty context would make every failed retrieval share one ungrounded cached quiz
+        cache = get_generation_cache() if context.strip() else None
+        cache_key = cache.make_key(model, QUESTIONS_DATA_PROMPT_VERSION, QUESTIONS_DATA_TEMPERATURE, context, questionsNo) if cache else None
+        questions_list = cache.get(cache_key) if cache else None
+        current.set(cache_hit=questions_list is not None, model=model)
+
+        if questions_list is None:
+            questions_list = complete_questions(context, questionsNo, model=model)
+            # A short list is still served, but only a complete one is cached for good
+            if cache and len(questions_list) == questionsNo:
+                cache.set(cache_key, questions_list)
+    return questions_list
+
+def generate_questions_data(context, questionsNo, model=QUESTIONS_DATA_MODEL):
+    # Identical concurrent requests share one generation; each caller still gets its own option order
+    flight_key = (model, QUESTIONS_DATA_PROMPT_VERSION, context, questionsNo)
+    questions_list = _generation_flight.do(flight_key, generate_raw_questions, context, questionsNo, model)
+    return [shuffle_question(question_data) for question_data in questions_list]
+
+def stream_questions_data(context, questionsNo, model=QUESTIONS_DATA_MODEL):
+    """Like generate_questions_data, but yields each question as soon as the model finishes writing it."""
+    with span("generate_questions", questions=questionsNo, stream=True) as current:
+        cache = get_generation_cache() if context.strip() else None
+        cache_key = cache.make_key(model, QUESTIONS_DATA_PROMPT_VERSION, QUESTIONS_DATA_TEMPERATURE, context, questionsNo) if cache else None
+        questions_list = cache.get(cache_key) if cache else None
+        current.set(cache_hit=questions_list is not None, model=model)
+        if questions_list is not None:
+            for question_data in questions_list:
+                yield shuffle_question(question_data)
+            return
+
+        messages = build_questions_messages(context, questionsNo)
+        questions_list = []
+        # A stream reports no usage, so its tokens are counted locally once it ends
+        with span("openai_stream", model=model) as streamed:
+            stream = create_chat_completion(
+                questionsNo * COMPLETION_TOKENS_PER_QUESTION,
+                model=model,
+                temperature=QUESTIONS_DATA_TEMPERATURE,
+                messages=messages,
+                stream=True
+            )
+
+            parser = IncrementalQuestionParser()
+            output = []
+            try:
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    output.append(delta)
+                    for question_data in parser.feed(delta):
+                        reason = validate_question(question_data)
+                        if reason:
+                            print(f"Discarded an invalid generated question: {reason}")
+                            continue
+                        questions_list.append(question_data)
+                        yield shuffle_question(question_data)
+            finally:
+                # Closing the HTTP stream when the consumer stops early ends the completion server-side too
+                close = getattr(stream, 'close', None)
+                if close:
+                    close()
+                streamed.set(
+                    prompt_tokens=count_tokens(''.join(m['content'] for m in messages)),
+                    completion_tokens=count_tokens(''.join(output)),
+                )
+
+        # Regenerate only what the stream failed to deliver
+        if len(questions_list) < questionsNo:
+            streamed_count = len(questions_list)
+            questions_list = complete_questions(context, questionsNo, questions_list, model)
+            for question_data in questions_list[streamed_count:]:
+                yield shuffle_question(question_data)
+
+        if cache and len(questions_list) == questionsNo:
+            cache.set(cache_key, questions_list)
+
+def shuffle_question(question_data):
+    """Shuffles the correct answer and distractors of a raw generated question into options A-D."""
+    question = question_data['question']
+    correct_answer = question_data['correct_answer']
+    distractors = [question_data.get('distractor1'), question_data.get('distractor2'), question_data.get('distractor3')]
+    support = question_data['support']
+
+    # Shuffle options
+    options = [correct_answer] + distractors
+    random.shuffle(options)
+
+    # Map shuffled options to 'A', 'B', 'C', 'D'
+    options_mapping = {chr(65 + i): option for i, option in enumerate(options)}
+    # Determine the key for the correct answer
+    answer_key = next(key for key, value in options_mapping.items() if value == correct_answer)
+
+    return {
+        "question": question,
+        "options": options_mapping,
+        "answer": answer_key,
+        "context": support
+    }
+
+def parse_document_to_json(document):
+    pattern = re.compile(
+        r"Question:\s*(.+?)\s+" +
+        r"A:\s*(.+?)\s+" + 
+        r"B:\s*(.+?)\s+" +
+        r"C:\s*(.+?)\s+" +
+        r"D:\s*(.+?)\s+" +
+        r"Answer:\s*(\w+)\s+" +
+        r"Context:\s*(.+)", re.DOTALL
+    )
+    match = pattern.search(document)
+    if match:
+        question, a, b, c, d, answer, context = match.groups()
+        options = {'A': a.strip(), 'B': b.strip(), 'C': c.strip(), 'D': d.strip()}
+        
+        # Randomly shuffle the options
+        option_keys = list(options.keys())
+        random_values = list(options.values())
+        random.shuffle(random_values)
+        shuffled_options = dict(zip(option_keys, random_values))
+
+        # Find the new key for the correct answer after shuffling
+        answer_key = next((k for k, v in shuffled_options.items() if v == answer.strip()), None)
+        if answer_key is None:
+            raise ValueError("Answer key not found in options after shuffling.")
+        
+        return {
+            "question": question.strip(),
+            "options": shuffled_options,
+            "answer": answer_key,
+            "context": context.strip()
+        }
+    else:
+        raise ValueError("The document format does not match the expected pattern. Document: " + document)
+
+def get_sources(documents):
+    return documents[:-1]
+
+def get_summary(documents):
+    return documents[-1].page_content
+
+def load_json(json_string):
+    """
+    Parses a JSON object, also accepting single-quoted Python-style dicts without mangling apostrophes.
+    """
+    json_data = parse_object(json_string.strip())
+    if json_data is None:
+        print("Failed to decode JSON:", json_string[:200])
+    return json_data
+    
+def lookup_bank_questions(query, num_questions):
+    """Serves a quiz from the pre-generated question bank, or returns [] when it is too thin on the topic."""
+    bank = get_question_bank()
+    if bank is None:
+        return []
+    candidates = dedupe_questions(bank.lookup(query, num_questions * 2), DUPLICATE_THRESHOLD)
+    if len(candidates) < num_questions:
+        return []
+    return [shuffle_question(question_data) for question_data in candidates[:num_questions]]
+
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise JobCancelled()
+
+def retrieve_mcqs(query, num_questions, cancel_event=None):
+    """Builds a quiz; setting cancel_event stops it between stages with JobCancelled."""
+    with span("retrieve_mcqs", questions=num_questions) as current:
+        with span("question_bank_lookup") as lookup:
+            bank_questions = lookup_bank_questions(query, num_questions)
+            lookup.set(cache_hit=bool(bank_questions))
+        if bank_questions:
+            return bank_questions
+
+        check_cancelled(cancel_event)
+        with span("retrieve_passages") as retrieval:
+            passages = retrieve_passages(query, num_questions)
+            retrieval.set(passages=len(passages))
+        if not passages:
+            # Questions without grounding context would be made up, so the caller reports a failed retrieval
+            return []
+
+        check_cancelled(cancel_event)
+        model = route_quiz_model(num_questions)
+        current.set(model=model)
+        # A quiz within one shard runs as a single shard, so waiting for it can still be cancelled
+        parsed_results = generate_questions_sharded(passages, num_questions, int(os.getenv('GENERATION_SHARD_SIZE', 5)), model, cancel_event)
+
+        with span("dedupe_questions"):
+            near_filter = NearDuplicateFilter(DUPLICATE_THRESHOLD)
+            unique_results = dedupe_questions(parsed_results, near_filter=near_filter)[:num_questions]
+        check_cancelled(cancel_event)
+        unique_results.extend(top_up_questions(passages, num_questions - len(unique_results), unique_results, near_filter, model))
+        current.set(returned=len(unique_results))
+        return unique_results
+
+def top_up_questions(passages, missing, existing_questions, near_filter, model=QUESTIONS_DATA_MODEL):
+    """Generates replacements for questions lost to deduplication, skipping any that are still near-duplicates."""
+    if missing <= 0 or not passages:
+        return []
+    try:
+        new_questions = request_questions('\n\n'.join(passages), missing, [q['question'] for q in existing_questions], model)
+    except Exception as e:
+        print(f"Top-up question generation failed: {e}")
+        return []
+    return dedupe_questions([shuffle_question(q) for q in new_questions], near_filter=near_filter)[:missing]
+
+def retrieve_passages(query, num_questions):
+    """Queries the corpus and packs the relevant passages into a token budget sized for num_questions."""
+    if MULTI_QUERY_VARIANTS > 0:
+        results = multi_query_search(query, MULTI_QUERY_VARIANTS)
+    else:
+        results = search_passages(query)
+    return pack_context(results or [], num_questions)
+
+def search_passages(query):
+    """Scored passages for one query, from Vectara and/or the local mirror according to RETRIEVAL_MODE."""
+    local_index = get_local_index()
+    mode = RETRIEVAL_MODE if local_index is not None else 'vectara'
+    if mode == 'local':
+        with span("local_index_search") as current:
+            results = local_index.search(query, 10)
+            current.set(cache_hit=len(results) >= LOCAL_MIN_RESULTS)
+        return results if len(results) >= LOCAL_MIN_RESULTS else search_vectara(query)
+    if mode in ('fallback', 'hybrid'):
+        # The local search runs while the Vectara query is in flight
+        remote = _retrieval_executor.submit(search_vectara, query)
+        with span("local_index_search"):
+            local_results = local_index.search(query, 10)
+        try:
+            remote_results = remote.result(timeout=VECTARA_QUERY_TIMEOUT)
+        except FutureTimeoutError:
+            print(f"Vectara query exceeded {VECTARA_QUERY_TIMEOUT}s, using the local index")
+            remote_results = None
+        except Exception as e:
+            print(f"Vectara query failed, using the local index: {e}")
+            remote_results = None
+        if mode == 'hybrid':
+            return reciprocal_rank_fusion([remote_results or [], local_results])
+        return remote_results or local_results
+    return search_vectara(query)
+
+def search_vectara(query):
+    summarizer_model = "vectara-summary-ext-v1.3.0"
+    corpus_id = int(os.getenv('CORPUS_ID'))
+    # Identical concurrent queries (e.g. a whole class on one topic) share a single Vectara call
+    flight_key = (corpus_id, " ".join(query.lower().split()))
+    return _query_flight.do(
+        flight_key,
+        get_searcher().send_query_with_scores,
+        corpus_id=corpus_id,
+        query_text=query,
+        num_results=10,
+        summarizer_prompt_name=summarizer_model,
+        response_lang="en",
+        max_summarized_results=5  
+    )
+
+def multi_query_search(query, variants):
+    """Searches the topic and up to `variants` rephrasings of it concurrently and fuses the rankings."""
+    executor = ThreadPoolExecutor(max_workers=variants + 2)
+    try:
+        # The original query runs while the variants are being written, so it adds no latency of its own
+        original = executor.submit(search_passages, query)
+        try:
+            variant_queries = executor.submit(generate_query_variants, query, variants).result(timeout=QUERY_VARIANTS_TIMEOUT)
+        except FutureTimeoutError:
+            print(f"Query variants took over {QUERY_VARIANTS_TIMEOUT}s, searching the topic alone")
+            variant_queries = []
+        except Exception as e:
+            print(f"Query variant generation failed, searching the topic alone: {e}")
+            variant_queries = []
+        variant_futures = [executor.submit(search_passages, variant) for variant in variant_queries]
+
+        result_lists = [original.result() or []]
+        for future in variant_futures:
+            try:
+                result_lists.append(future.result() or [])
+            except Exception as e:
+                print(f"A query variant search failed: {e}")
+    finally:
+        # Late variants still finish and land in the cache for the next quiz; nothing waits for them here
+        executor.shutdown(wait=False)
+    return reciprocal_rank_fusion(result_lists)
+
+def generate_query_variants(query, count):
+    """Asks a small, fast model for alternative search queries covering other aspects of the topic."""
+    temperature = 0
+    with span("query_variants", variants=count) as current:
+        cache = get_generation_cache()
+        cache_key = cache.make_key(QUERY_VARIANTS_MODEL, QUERY_VARIANTS_PROMPT_VERSION, temperature, query, count) if cache else None
+        variants = cache.get(cache_key) if cache else None
+        current.set(cache_hit=variants is not None)
+        if variants is not None:
+            return variants
+
+        response = create_chat_completion(
+            20 * count,
+            model=QUERY_VARIANTS_MODEL,
+            temperature=temperature,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": "You write search queries for a document retrieval system."},
+                {"role": "user", "content": f"""Write {count} different search queries that would retrieve passages about other aspects, subtopics or phrasings of the topic below.
+    Return a JSON object with a 'queries' key holding a list of {count} strings.
+
+    Topic: {query}"""}
+            ])
+        data = parse_object(response.choices[0].message.content)
+        candidates = data.get('queries', []) if isinstance(data, dict) else data
+        seen = {" ".join(query.lower().split())}
+        variants = []
+        for candidate in candidates if isinstance(candidates, list) else []:
+            if not isinstance(candidate, str) or " ".join(candidate.lower().split()) in seen:
+                continue
+            seen.add(" ".join(candidate.lower().split()))
+            variants.append(candidate.strip())
+        variants = variants[:count]
+        if cache and variants:
+            cache.set(cache_key, variants)
+        return variants
+
+def split_shards(passages, num_questions, shard_size):
+    """Splits a quiz into (context, question count) shards of at most shard_size questions each."""
+    num_shards = max(1, -(-num_questions // shard_size))
+    shard_counts = [num_questions // num_shards + (1 if i < num_questions % num_shards else 0) for i in range(num_shards)]
+    # Deal passages round-robin so every shard sees different context; fall back to all passages if too few
+    shard_contexts = ['\n\n'.join(passages[i::num_shards] or passages) for i in range(num_shards)]
+    return list(zip(shard_contexts, shard_counts))
+
+def stream_mcqs(query, num_questions, cancel_event=None):
+    """Streaming counterpart of retrieve_mcqs that yields distinct questions as they are generated.
+
+    Setting cancel_event, or closing the generator, stops every shard at its next streamed question.
+    """
+    with span("retrieve_mcqs", questions=num_questions, stream=True) as current:
+        with span("question_bank_lookup") as lookup:
+            bank_questions = lookup_bank_questions(query, num_questions)
+            lookup.set(cache_hit=bool(bank_questions))
+        if bank_questions:
+            yield from bank_questions
+            return
+
+        with span("retrieve_passages") as retrieval:
+            passages = retrieve_passages(query, num_questions)
+            retrieval.set(passages=len(passages))
+        if not passages:
+            return
+        check_cancelled(cancel_event)
+        model = route_quiz_model(num_questions)
+        current.set(model=model)
+        shards = split_shards(passages, num_questions, int(os.getenv('GENERATION_SHARD_SIZE', 5)))
+
+        # Each shard streams into a shared queue so questions are yielded in arrival order
+        questions_queue = queue.Queue()
+        stopped = threading.Event()
+        def run_shard(context, count):
+            try:
+                for question in stream_questions_data(context, count, model):
+                    if stopped.is_set() or (cancel_event is not None and cancel_event.is_set()):
+                        break
+                    questions_queue.put(question)
+            except Exception as e:
+                print(f"A question generation shard failed: {e}")
+            finally:
+                questions_queue.put(None)
+
+        near_filter = NearDuplicateFilter(DUPLICATE_THRESHOLD)
+        accepted_questions = []
+        executor = ThreadPoolExecutor(max_workers=len(shards))
+        try:
+            for context, count in shards:
+                executor.submit(run_shard, context, count)
+            finished_shards = 0
+            while finished_shards < len(shards):
+                try:
+                    question = questions_queue.get(timeout=CANCEL_POLL_INTERVAL)
+                except queue.Empty:
+                    check_cancelled(cancel_event)
+                    continue
+                if question is None:
+                    finished_shards += 1
+                elif len(accepted_questions) < num_questions and near_filter.add(question_fingerprint(question)):
+                    accepted_questions.append(question)
+                    yield question
+        finally:
+            # If the consumer stops early, shards stop streaming and nothing waits for them here
+            stopped.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        check_cancelled(cancel_event)
+
+        top_up = top_up_questions(passages, num_questions - len(accepted_questions), accepted_questions, near_filter, model)
+        current.set(returned=len(accepted_questions) + len(top_up))
+        yield from top_up
+
+def generate_questions_sharded(passages, num_questions, shard_size, model=QUESTIONS_DATA_MODEL, cancel_event=None):
+    """Splits a large quiz into concurrent smaller generations, each over a different slice of the passages."""
+    shards = split_shards(passages, num_questions, shard_size)
+
+    results_by_shard = [[] for _ in shards]
+    executor = ThreadPoolExecutor(max_workers=len(shards))
+    try:
+        futures = {executor.submit(generate_questions_data, context, count, model): i for i, (context, count) in enumerate(shards)}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    results_by_shard[futures[future]] = future.result()
+                except Exception as e:
+                    print(f"A question generation shard failed: {e}")
+            check_cancelled(cancel_event)
+    finally:
+        # On cancellation the in-flight completions finish on their own; nothing waits for them
+        executor.shutdown(wait=False, cancel_futures=True)
+    return [question for shard_results in results_by_shard for question in shard_results]
@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution whose result every caller receives."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn: Callable, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+class RateLimitTimeout(RuntimeError):
+    pass
+
+
+class TokenBucketLimiter:
+    """Shared requests-per-minute and tokens-per-minute budget; callers queue until both buckets allow them."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_wait: float = 120.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait = max_wait
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        self.waiting = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60.0)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60.0)
+
+    def _wait_time(self, tokens: float) -> float:
+        waits = [0.0]
+        if self.requests_per_minute and self._requests < 1:
+            waits.append((1 - self._requests) * 60.0 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < tokens:
+            waits.append((tokens - self._tokens) * 60.0 / self.tokens_per_minute)
+        return max(waits)
+
+    def acquire(self, tokens: float = 0):
+        """Blocks until one request and the estimated tokens fit in the budget."""
+        if self.tokens_per_minute:
+            # A single request larger than the whole bucket would otherwise wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+        deadline = time.monotonic() + self.max_wait
+        with self._condition:
+            self.waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    wait = self._wait_time(tokens)
+                    if wait <= 0:
+                        if self.requests_per_minute:
+                            self._requests -= 1
+                        if self.tokens_per_minute:
+                            self._tokens -= tokens
+                        return
+                    if time.monotonic() + wait > deadline:
+                        raise RateLimitTimeout("Rate limit queue wait exceeded; try again shortly")
+                    self._condition.wait(wait)
+            finally:
+                self.waiting -= 1
+
+    def reconcile(self, estimated_tokens: float, actual_tokens: float):
+        """Corrects the token bucket once the real usage of a request is known."""
+        if not self.tokens_per_minute:
+            return
+        with self._condition:
+            self._tokens = min(self.tokens_per_minute, self._tokens + estimated_tokens - actual_tokens)
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            self._refill()
+            return {"requests_available": self._requests, "tokens_available": self._tokens, "waiting": self.waiting}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) used for budgeting."""
+    return len(text) // 4 + 1
+
+
+_openai_limiter = None
+_openai_limiter_lock = threading.Lock()
+
+
+def get_openai_limiter() -> Optional[TokenBucketLimiter]:
+    """Returns the process-wide OpenAI budget from OPENAI_RPM / OPENAI_TPM, or None if both are 0."""
+    global _openai_limiter
+    requests_per_minute = float(os.getenv('OPENAI_RPM', 60))
+    tokens_per_minute = float(os.getenv('OPENAI_TPM', 40000))
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    with _openai_limiter_lock:
+        if _openai_limiter is None:
+            _openai_limiter = TokenBucketLimiter(
+                requests_per_minute, tokens_per_minute, max_wait=float(os.getenv('OPENAI_QUEUE_TIMEOUT', 120))
+            )
+        return _openai_limiter
@@ -0,0 +1,36 @@
+import threading
+from collections import deque
+
+import generation
+
+
+def test_hedges_are_capped_to_a_share_of_calls(monkeypatch):
+    monkeypatch.setattr(generation, '_hedge_history', deque(maxlen=generation.HEDGE_WINDOW))
+    monkeypatch.setattr(generation, 'HEDGE_MAX_SHARE', 0.1)
+    calls = []
+    lock = threading.Lock()
+
+    def slow_completion():
+        with lock:
+            calls.append(1)
+        threading.Event().wait(0.01)
+        return "done"
+
+    for _ in range(50):
+        assert generation.call_with_hedge(slow_completion, 0.0, 5.0) == "done"
+
+    # Every call wanted a hedge; only a tenth of them may get one
+    assert 50 < len(calls) <= 55
+
+
+def test_no_hedge_when_the_caller_is_backed_up(monkeypatch):
+    monkeypatch.setattr(generation, '_hedge_history', deque([0] * 100, maxlen=generation.HEDGE_WINDOW))
+    calls = []
+
+    def slow_completion():
+        calls.append(1)
+        threading.Event().wait(0.01)
+        return "done"
+
+    generation.call_with_hedge(slow_completion, 0.0, 5.0, can_hedge=lambda: False)
+    assert len(calls) == 1
@@ -0,0 +1,55 @@
+import quiz
+
+
+def raw_question(question, answer):
+    return {
+        'question': question,
+        'correct_answer': answer,
+        'distractor1': 'Mercury',
+        'distractor2': 'Venus',
+        'distractor3': 'Saturn',
+        'support': 'From the passage.',
+    }
+
+
+def test_top_up_skips_near_duplicates_of_kept_questions(monkeypatch):
+    kept = raw_question("Which planet is known as the red planet?", "Mars")
+    monkeypatch.setattr(quiz, 'lookup_bank_questions', lambda query, num_questions: [])
+    monkeypatch.setattr(quiz, 'retrieve_passages', lambda query, num_questions: ["Mars is the red planet."])
+    monkeypatch.setattr(quiz, 'route_quiz_model', lambda num_questions: quiz.QUESTIONS_DATA_MODEL)
+    # Deduplication drops the second question, so one replacement has to be topped up
+    monkeypatch.setattr(
+        quiz, 'generate_questions_sharded',
+        lambda passages, num_questions, shard_size, model, cancel_event: [quiz.shuffle_question(kept), quiz.shuffle_question(kept)],
+    )
+    monkeypatch.setattr(
+        quiz, 'request_questions',
+        lambda context, questionsNo, exclude_questions, model: [kept, raw_question("What is the largest planet?", "Jupiter")],
+    )
+
+    results = quiz.retrieve_mcqs("planets", 2)
+
+    assert [q['question'] for q in results] == [kept['question'], "What is the largest planet?"]
+
+
+class DictCache:
+    def __init__(self):
+        self.entries = {}
+
+    def make_key(self, *parts):
+        return repr(parts)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries[key] = value
+
+
+def test_short_question_lists_are_not_cached(monkeypatch):
+    cache = DictCache()
+    monkeypatch.setattr(quiz, 'get_generation_cache', lambda: cache)
+    monkeypatch.setattr(quiz, 'complete_questions', lambda context, questionsNo, model: [raw_question("Which planet is red?", "Mars")])
+
+    assert len(quiz.generate_raw_questions("Mars is the red planet.", 2)) == 1
+    assert cache.entries == {}
@@ -1,32 +1,240 @@
 import json
 import logging
-import mimetypes
 import os
-from typing import Tuple
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, Tuple
 
 import requests
-from authlib.integrations.requests_client import OAuth2Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
+from cache import get_retrieval_cache
+from manifest import file_digest, get_index_manifest
+from metrics import registry, span
+
 # Load environment variables from .env file
 load_dotenv()
 
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Base URL of the Vectara REST API; overridable so the app can run against local stand-in servers
+API_URL = os.getenv('VECTARA_API_URL', 'https://api.vectara.io').rstrip('/')
+
+# Shared HTTP transport settings
+CONNECT_TIMEOUT = float(os.getenv('VECTARA_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('VECTARA_READ_TIMEOUT', 120))
+MAX_RETRIES = int(os.getenv('VECTARA_MAX_RETRIES', 3))
+BACKOFF_FACTOR = float(os.getenv('VECTARA_BACKOFF_FACTOR', 0.5))
+POOL_SIZE = int(os.getenv('VECTARA_POOL_SIZE', 16))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Largest non-text upload for which Vectara is asked to echo the extracted text back to index listeners
+EXTRACT_TEXT_MAX_BYTES = int(os.getenv('EXTRACT_TEXT_MAX_BYTES', 20 * 1024 * 1024))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class JitterRetry(Retry):
+    """Exponential backoff with full jitter so concurrent clients do not retry in lockstep."""
+
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide keep-alive session used for every Vectara call."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = JitterRetry(
+                total=MAX_RETRIES,
+                # A read error means the request may already have been processed; re-sending a
+                # non-idempotent upload or index POST would then fail with ALREADY_EXISTS
+                read=0,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=None,  # Vectara uses POST for queries and uploads, so retry every method
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+class MultipartFileStream:
+    """File-like multipart/form-data body that reads the file in chunks instead of buffering it."""
+
+    def __init__(self, fileobj, filename: str, mime_type: str, field_name: str = "file", chunk_size: int = UPLOAD_CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        safe_name = filename.replace('"', '%22').replace('\r', '').replace('\n', '')
+        self.head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{safe_name}"\r\n'
+            f"Content-Type: {mime_type}\r\n\r\n"
+        ).encode("utf-8")
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self.file_start = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        self.file_size = fileobj.tell() - self.file_start
+        fileobj.seek(self.file_start)
+        self.position = 0
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """Rewinds the body, used when a request has to be re-sent."""
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += len(self)
+        self.position = max(0, min(offset, len(self)))
+        file_offset = min(max(self.position - len(self.head), 0), self.file_size)
+        self.fileobj.seek(self.file_start + file_offset)
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.chunk_size
+        parts = []
+        while size > 0 and self.position < len(self):
+            if self.position < len(self.head):
+                chunk = self.head[self.position:self.position + size]
+            elif self.position < len(self.head) + self.file_size:
+                remaining = len(self.head) + self.file_size - self.position
+                chunk = self.fileobj.read(min(size, remaining, self.chunk_size))
+                if not chunk:
+                    raise IOError("File ended before the expected upload size was sent")
+            else:
+                offset = self.position - len(self.head) - self.file_size
+                chunk = self.tail[offset:offset + size]
+            parts.append(chunk)
+            self.position += len(chunk)
+            size -= len(chunk)
+        return b"".join(parts)
+
+
+def record_transfer(stage: str, response: requests.Response, sent_bytes: int):
+    """Records an HTTP exchange with its server-side elapsed time and bytes transferred."""
+    registry.record_value(stage, response.elapsed.total_seconds(), bytes=sent_bytes + len(response.content), status=response.status_code)
+
+
+def base_url(address: str) -> str:
+    """Turns an indexing address into a base URL; a bare host name means HTTPS."""
+    address = address.rstrip('/')
+    return address if "://" in address else f"https://{address}"
+
+
+def document_text(doc: dict) -> str:
+    """Flattens the title and (nested) section texts of a Vectara document into plain text."""
+    parts = [doc.get("title") or ""]
+    for section in doc.get("section") or doc.get("sections") or []:
+        parts.append(section.get("title") or "")
+        parts.append(section.get("text") or "")
+        if section.get("section"):
+            parts.append(document_text({"section": section["section"]}))
+    return "\n\n".join(part for part in parts if part)
+
+
+class TokenManager:
+    """Caches a client-credentials JWT and refreshes it in the background before it expires."""
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, auth_url: str, client_id: str, client_secret: str, refresh_margin: float = 60.0):
+        self.auth_url = auth_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @classmethod
+    def get_instance(cls, auth_url: str, client_id: str, client_secret: str) -> "TokenManager":
+        """Returns the process-wide manager for these credentials."""
+        key = (auth_url, client_id)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(auth_url, client_id, client_secret)
+            return cls._instances[key]
+
+    def get_token(self) -> str:
+        """Returns the cached token, fetching a new one if it is missing or about to expire."""
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._expires_at - self.refresh_margin:
+                self._refresh_locked()
+            return self._token
+
+    def invalidate(self):
+        """Drops the cached token so the next call fetches a fresh one."""
+        with self._lock:
+            self._token = None
+
+    def _refresh_locked(self):
+        from authlib.integrations.requests_client import OAuth2Session
+
+        token_endpoint = f"{self.auth_url}/oauth2/token"
+        session = OAuth2Session(self.client_id, self.client_secret, scope="")
+        token = session.fetch_token(token_endpoint, grant_type="client_credentials")
+        self._token = token["access_token"]
+        expires_in = float(token.get("expires_in") or 3600)
+        self._expires_at = time.monotonic() + expires_in
+        self._schedule_refresh(max(expires_in - self.refresh_margin, 1.0))
+
+    def _schedule_refresh(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                self._refresh_locked()
+        except Exception as e:
+            logging.error("Background token refresh failed: %s", str(e))
+            # Try again shortly; get_token will also refresh on demand
+            self._schedule_refresh(min(30.0, self.refresh_margin))
+
+
 class Indexing:
     def __init__(self):
         self.auth_url = os.getenv('AUTH_URL')
         self.app_client_id = os.getenv('APP_CLIENT_ID')
         self.app_client_secret = os.getenv('APP_CLIENT_SECRET')
-        self.jwt_token = self._get_jwt_token()
+        self.token_manager = TokenManager.get_instance(self.auth_url, self.app_client_id, self.app_client_secret)
         self.customer_id = os.getenv('CUSTOMER_ID')
         self.api_key = os.getenv('API_KEY')
         self.corpus_id = os.getenv('CORPUS_ID')
+        # Callbacks run as listener(doc_id, text) after a document is indexed successfully
+        self.listeners = []
 
-    def _get_jwt_token(self) -> str:
-        """Connect to the server and get a JWT token."""
-        token_endpoint = f"{self.auth_url}/oauth2/token"
-        session = OAuth2Session(self.app_client_id, self.app_client_secret, scope="")
-        token = session.fetch_token(token_endpoint, grant_type="client_credentials")
-        return token["access_token"]
+    @property
+    def jwt_token(self) -> str:
+        """JWT token from the shared token manager, fetched lazily on first use."""
+        return self.token_manager.get_token()
     
     def upload_file(self, customer_id: int, corpus_id: int, idx_address: str, uploaded_file, file_title: str) -> Tuple[requests.Response, bool]:
             """Uploads a file to the corpus."""
@@ -42,20 +250,30 @@ class Indexing:
             file_extension = os.path.splitext(uploaded_file.name)[-1]
             mime_type = extension_to_mime_type.get(file_extension, 'application/octet-stream')
 
-            #mime_type = mimetypes.guess_type(uploaded_file.name)[0] or 'application/octet-stream'
-
-            post_headers = {
-                "Authorization": f"Bearer {self.jwt_token}"
-            }
-            
             try:
-                file = uploaded_file.read()  
-                files = {"file": (file_title, file, mime_type)}
-                response = requests.post(
-                    f"https://{idx_address}/v1/upload?c={customer_id}&o={corpus_id}",
-                    files=files,
-                    headers=post_headers
-                )
+                # Stream the file body in chunks so large documents are never held in memory at once
+                body = MultipartFileStream(uploaded_file, file_title, mime_type)
+                for attempt in range(2):
+                    post_headers = {
+                        "Authorization": f"Bearer {self.jwt_token}",
+                        "Content-Type": body.content_type
+                    }
+                    # Ask Vectara to echo the extracted text when someone wants to post-process it. Plain text is
+                    # read from the file itself, and very large documents are not echoed so the response
+                    # does not hold their whole text in memory
+                    extract = "&d=true" if self.listeners and mime_type != 'text/plain' and body.file_size <= EXTRACT_TEXT_MAX_BYTES else ""
+                    response = get_session().post(
+                        f"{base_url(idx_address)}/v1/upload?c={customer_id}&o={corpus_id}{extract}",
+                        data=body,
+                        headers=post_headers,
+                        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+                    )
+                    record_transfer("vectara_upload_http", response, len(body))
+                    if response.status_code != 401 or attempt:
+                        break
+                    # The token was rejected (revoked or expired early): fetch a new one and retry once
+                    self.token_manager.invalidate()
+                    body.seek(0)
             
                 if response.status_code != 200:
                     logging.error("REST upload failed with code %d, reason %s, text %s",
@@ -63,11 +281,116 @@ class Indexing:
                                 response.reason,
                                 response.text)
                     return response, False
+                # New content makes cached retrieval results for this corpus stale
+                get_retrieval_cache().invalidate_corpus(corpus_id)
+                if self.listeners:
+                    if mime_type != 'text/plain' and body.file_size > EXTRACT_TEXT_MAX_BYTES:
+                        logging.info("%s is larger than EXTRACT_TEXT_MAX_BYTES; index listeners get no text for it", file_title)
+                    self._notify_listeners(file_title, self._uploaded_text(response, uploaded_file, mime_type))
                 return response, True
             except Exception as e:
                 logging.error("An error occurred while uploading the file: %s", str(e))
                 return None, False
     
+    def _uploaded_text(self, response, uploaded_file, mime_type: str) -> str:
+        """Text of an uploaded document, read directly for plain text or taken from Vectara's extraction."""
+        if mime_type == 'text/plain':
+            uploaded_file.seek(0)
+            return uploaded_file.read(EXTRACT_TEXT_MAX_BYTES).decode("utf-8", errors="replace")
+        try:
+            document = response.json().get("document")
+        except ValueError:
+            document = None
+        return document_text(document) if document else ""
+
+    def _notify_listeners(self, doc_id: str, text: str):
+        for listener in self.listeners:
+            try:
+                listener(doc_id, text)
+            except Exception as e:
+                logging.error("Index listener failed for %s: %s", doc_id, str(e))
+
+    def upload_files(self, customer_id: int, corpus_id: int, idx_address: str, uploaded_files, max_workers: int = 4, text_via_index_doc: bool = False) -> Iterator[Tuple[object, requests.Response, bool, bool]]:
+        """Uploads several files concurrently, yielding (file, response, success, skipped) as each one finishes.
+
+        Files whose content the index manifest has already recorded for this corpus are skipped before any
+        network I/O. With text_via_index_doc, .txt files go through index_doc on the shared session instead
+        of the upload endpoint.
+        """
+        max_workers = max(1, min(max_workers, len(uploaded_files) or 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._index_if_changed, customer_id, corpus_id, idx_address, uploaded_file, text_via_index_doc): uploaded_file
+                for uploaded_file in uploaded_files
+            }
+            try:
+                for future in as_completed(futures):
+                    response, success, skipped = future.result()
+                    yield futures[future], response, success, skipped
+            finally:
+                # If the caller stops early (e.g. a cancelled job), uploads that have not started are dropped
+                for future in futures:
+                    future.cancel()
+
+    def _index_if_changed(self, customer_id: int, corpus_id: int, idx_address: str, uploaded_file, text_via_index_doc: bool):
+        manifest = get_index_manifest()
+        if manifest:
+            digest, size = file_digest(uploaded_file)
+            if manifest.is_unchanged(corpus_id, uploaded_file.name, digest):
+                return None, True, True
+        start = uploaded_file.tell()
+        response, success, exists = self._index_once(customer_id, corpus_id, idx_address, uploaded_file, text_via_index_doc)
+        if exists:
+            # A document with this id holds other content (it changed, or was indexed before the manifest
+            # existed): replace it so the new content is what ends up indexed
+            uploaded_file.seek(start)
+            if self.delete_doc(corpus_id, uploaded_file.name):
+                response, success, exists = self._index_once(customer_id, corpus_id, idx_address, uploaded_file, text_via_index_doc)
+            success = success and not exists
+        if success and manifest:
+            manifest.record(corpus_id, uploaded_file.name, digest, size)
+        return response, success, False
+
+    def _index_once(self, customer_id: int, corpus_id: int, idx_address: str, uploaded_file, text_via_index_doc: bool):
+        """Indexes a file once, returning (response, success, already_exists)."""
+        if text_via_index_doc and uploaded_file.name.lower().endswith('.txt'):
+            return self._index_text_file(uploaded_file)
+        response, success = self.upload_file(customer_id, corpus_id, idx_address, uploaded_file, uploaded_file.name)
+        return response, success, response is not None and response.status_code == 409
+
+    def _index_text_file(self, uploaded_file) -> Tuple[requests.Response, bool, bool]:
+        """Indexes a plain-text file as a single-section document through index_doc."""
+        try:
+            text = uploaded_file.read().decode("utf-8", errors="replace")
+            doc = {"documentId": uploaded_file.name, "title": uploaded_file.name, "section": [{"text": text}]}
+            result = self.index_doc(get_session(), doc)
+        except Exception as e:
+            logging.error("An error occurred while indexing the file: %s", str(e))
+            return None, False, False
+        if result == "E_NO_PERMISSIONS":
+            logging.error("Indexing %s was forbidden", uploaded_file.name)
+        return None, result == "E_SUCCEEDED", result == "E_ALREADY_EXISTS"
+
+    def delete_doc(self, corpus_id: int, doc_id: str) -> bool:
+        """Deletes a document from the corpus; returns whether Vectara accepted the deletion."""
+        req_body = json.dumps({"customerId": self.customer_id, "corpusId": corpus_id, "documentId": doc_id})
+        try:
+            response = get_session().post(
+                headers=self.get_post_headers(),
+                url=f"{API_URL}/v1/delete-doc",
+                data=req_body,
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            )
+        except requests.RequestException as e:
+            logging.error("Deleting %s failed: %s", doc_id, str(e))
+            return False
+        record_transfer("vectara_delete_http", response, len(req_body))
+        if response.status_code != 200:
+            logging.error("Deleting %s failed with code %d: %s", doc_id, response.status_code, response.text)
+            return False
+        get_retrieval_cache().invalidate_corpus(corpus_id)
+        return True
+
     def get_post_headers(self) -> dict:
         """Returns headers that should be attached to each post request."""
         return {
@@ -77,20 +400,23 @@ class Indexing:
         }
 
     def index_doc(self, session, doc: dict) -> str:
+        session = session or get_session()
         req = {
             "customerId": self.customer_id,
             "corpusId": self.corpus_id,
             "document": doc
         }
+        req_body = json.dumps(req)
 
         response = session.post(
             headers=self.get_post_headers(),
-            url="https://api.vectara.io/v1/index",
-            data=json.dumps(req),
+            url=f"{API_URL}/v1/index",
+            data=req_body,
             timeout=250,
             verify=True,
         )
 
+        record_transfer("vectara_index_http", response, len(req_body))
         status_code = response.status_code
         result = response.json()
         
@@ -100,6 +426,9 @@ class Indexing:
         elif status_str and (status_str == "FORBIDDEN"):
             return "E_NO_PERMISSIONS"
         else:
+            get_retrieval_cache().invalidate_corpus(self.corpus_id)
+            if self.listeners:
+                self._notify_listeners(doc.get("documentId") or doc.get("document_id", ""), document_text(doc))
             return "E_SUCCEEDED"
 
 
@@ -107,8 +436,32 @@ class Searching:
     def __init__(self):
         self.customer_id = os.getenv('CUSTOMER_ID')
         self.api_key = os.getenv('API_KEY')
+        self.cache = get_retrieval_cache()
 
     def send_query(self, corpus_id, query_text, num_results, summarizer_prompt_name, response_lang, max_summarized_results):
+        """Returns the matching passages, served from the retrieval cache when possible."""
+        results = self.send_query_with_scores(corpus_id, query_text, num_results, summarizer_prompt_name, response_lang, max_summarized_results)
+        return [result['text'] for result in results] if results is not None else None
+
+    def send_query_with_scores(self, corpus_id, query_text, num_results, summarizer_prompt_name, response_lang, max_summarized_results):
+        """Like send_query, but returns {'text', 'score'} dicts in Vectara's ranking order."""
+        with span("vectara_query") as current:
+            start = time.perf_counter()
+            cache_key = self.cache.make_key(corpus_id, query_text, num_results, summarizer_prompt_name, response_lang)
+            results = self.cache.get(cache_key)
+            current.set(cache_hit=results is not None)
+            if results is not None:
+                self.cache.record(True, time.perf_counter() - start)
+                # Entries written before scores were cached hold plain strings
+                return [{'text': r, 'score': None} if isinstance(r, str) else r for r in results]
+
+            results = self._query(corpus_id, query_text, num_results, summarizer_prompt_name, response_lang, max_summarized_results)
+            if results is not None:
+                self.cache.set(cache_key, corpus_id, results)
+            self.cache.record(False, time.perf_counter() - start)
+            return results
+
+    def _query(self, corpus_id, query_text, num_results, summarizer_prompt_name, response_lang, max_summarized_results):
         api_key_header = {
             "customer-id": self.customer_id,
             "x-api-key": self.api_key,
@@ -134,18 +487,25 @@ class Searching:
 
         payload = json.dumps(data_dict)
 
-        response = requests.post(
-            "https://api.vectara.io/v1/query",
-            data=payload,
-            verify=True,
-            headers=api_key_header
-        )
+        try:
+            response = get_session().post(
+                f"{API_URL}/v1/query",
+                data=payload,
+                verify=True,
+                headers=api_key_header,
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+            )
+        except requests.RequestException as e:
+            print("Request failed:", e)
+            return None
 
+        record_transfer("vectara_query_http", response, len(payload))
         if response.status_code == 200:
             print("Request was successful!")
             data = response.json()
-            texts = [item['text'] for item in data['responseSet'][0]['response'] if 'text' in item]
-            return texts
+            results = [{'text': item['text'], 'score': item.get('score')}
+                       for item in data['responseSet'][0]['response'] if 'text' in item]
+            return results
         else:
             print("Request failed with status code:", response.status_code)
             print("Response:", response.text)